@@ -0,0 +1,407 @@
+"""
+Load and latency benchmark for the HTTP API.
+
+Boots ``main.app`` under uvicorn against a throwaway SQLite file, seeds it,
+then drives a weighted mix of catalog reads, purchases, history lookups and
+``/query/actions`` calls at each concurrency level. The LLM is the synthetic
+backend unless LLM_BACKEND says otherwise (e.g. ``replay``). Results are
+printed, or written to ``--output``, as JSON so runs can be compared across
+commits. From ``src/``::
+
+    python -m benchmarks.http_load --concurrency 1,8,32 --duration 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+from sqlalchemy import func
+from sqlmodel import Session, create_engine, select
+
+from benchmarks.seed_data import SeedSpec, seed_database
+from domain.models.customer import CustomerDb
+from domain.models.soda import Soda
+from domain.models.transaction_customer import TransactionCustomer
+
+SRC_DIR = Path(__file__).resolve().parents[1]
+
+
+@dataclass(frozen=True)
+class Dataset:
+    soda_ids: Tuple[int, ...]
+    soda_names: Tuple[str, ...]
+    customer_ids: Tuple[int, ...]
+    transactions: int
+
+
+# Method, path, JSON body
+Request = Tuple[str, str, Optional[Dict[str, Any]]]
+
+
+@dataclass(frozen=True)
+class Operation:
+    name: str
+    build: Callable[[random.Random, Dataset], Request]
+
+
+def _catalog_page(rng: random.Random, data: Dataset) -> Request:
+    return "GET", "/soda?limit=50", None
+
+
+def _soda_by_id(rng: random.Random, data: Dataset) -> Request:
+    return "GET", f"/soda/{rng.choice(data.soda_ids)}", None
+
+
+def _purchase(rng: random.Random, data: Dataset) -> Request:
+    body = {
+        "customer_id": rng.choice(data.customer_ids),
+        "soda_id": rng.choice(data.soda_ids),
+        "quantity": rng.randint(1, 3),
+    }
+    return "POST", "/transaction", body
+
+
+def _history(rng: random.Random, data: Dataset) -> Request:
+    return (
+        "GET",
+        f"/transaction/customer/{rng.choice(data.customer_ids)}?limit=50",
+        None,
+    )
+
+
+def _query_actions(rng: random.Random, data: Dataset) -> Request:
+    soda = rng.choice(data.soda_names)
+    query = rng.choice(
+        (
+            f"I'd like {rng.randint(1, 3)} {soda} please",
+            f"buy a {soda}",
+            "show my purchase history",
+            "what have I bought so far?",
+            "hello there",
+        )
+    )
+    body = {"customer_id": rng.choice(data.customer_ids), "query": query}
+    return "POST", "/query/actions", body
+
+
+OPERATIONS = {
+    operation.name: operation
+    for operation in (
+        Operation("catalog_page", _catalog_page),
+        Operation("soda_by_id", _soda_by_id),
+        Operation("purchase", _purchase),
+        Operation("history", _history),
+        Operation("query_actions", _query_actions),
+    )
+}
+DEFAULT_MIX = "catalog_page=30,soda_by_id=20,purchase=20,history=20,query_actions=10"
+
+
+def load_dataset(database_url: str) -> Dataset:
+    engine = create_engine(database_url)
+    with Session(engine) as session:
+        sodas = session.exec(select(Soda.id, Soda.name).order_by(Soda.id)).all()
+        customer_ids = session.exec(select(CustomerDb.id).order_by(CustomerDb.id)).all()
+        transactions = session.exec(select(func.count(TransactionCustomer.id))).one()
+    engine.dispose()
+    if not sodas or not customer_ids:
+        raise SystemExit("The database needs at least one soda and one customer")
+    return Dataset(
+        soda_ids=tuple(soda_id for soda_id, _ in sodas),
+        soda_names=tuple(name for _, name in sodas),
+        customer_ids=tuple(customer_ids),
+        transactions=transactions,
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(env: Dict[str, str], port: int, workers: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ],
+        cwd=SRC_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"The server exited with {server.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("The server did not come up within 60s")
+
+
+def _percentile(ordered: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(latencies_ms: List[float], errors: int, seconds: float) -> Dict[str, Any]:
+    ordered = sorted(latencies_ms)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / seconds, 2),
+        "mean_ms": round(sum(ordered) / len(ordered), 3) if ordered else 0.0,
+        "p50_ms": round(_percentile(ordered, 50), 3),
+        "p95_ms": round(_percentile(ordered, 95), 3),
+        "p99_ms": round(_percentile(ordered, 99), 3),
+        "max_ms": round(ordered[-1], 3) if ordered else 0.0,
+    }
+
+
+async def run_level(
+    base_url: str,
+    data: Dataset,
+    mix: Dict[str, float],
+    concurrency: int,
+    warmup: float,
+    duration: float,
+    seed: int,
+) -> Dict[str, Any]:
+    """
+    ``concurrency`` closed-loop clients, each sending its next request as
+    soon as the last one answered. Requests started during the warmup are
+    not counted.
+    """
+    operations = [OPERATIONS[name] for name in mix]
+    weights = list(mix.values())
+    latencies: Dict[str, List[float]] = {name: [] for name in mix}
+    errors: Dict[str, int] = {name: 0 for name in mix}
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    async def client_loop(client: httpx.AsyncClient, rng: random.Random) -> None:
+        while True:
+            sent = time.perf_counter()
+            if sent >= stop_at:
+                return
+            operation = rng.choices(operations, weights)[0]
+            method, path, body = operation.build(rng, data)
+            try:
+                response = await client.request(method, path, json=body)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            if sent < measure_from:
+                continue
+            latencies[operation.name].append((time.perf_counter() - sent) * 1000)
+            if failed:
+                errors[operation.name] += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+        await asyncio.gather(
+            *(
+                client_loop(client, random.Random(seed * 1000 + i))
+                for i in range(concurrency)
+            )
+        )
+    # Requests in flight at stop_at still finish; count the time they took.
+    seconds = max(duration, time.perf_counter() - measure_from)
+    endpoints = {
+        name: summarize(latencies[name], errors[name], seconds) for name in mix
+    }
+    overall = summarize(
+        [latency for values in latencies.values() for latency in values],
+        sum(errors.values()),
+        seconds,
+    )
+    return {"concurrency": concurrency, **overall, "endpoints": endpoints}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(
+                f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}"
+            )
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=SRC_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _copy_database(source: Path, target: Path) -> None:
+    """Consistent copy of a SQLite file, WAL contents included."""
+    if not source.is_file():
+        raise SystemExit(f"No such database: {source}")
+    with (
+        closing(sqlite3.connect(source)) as src,
+        closing(sqlite3.connect(target)) as dst,
+    ):
+        src.backup(dst)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sodas", type=int, default=200)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=50000)
+    parser.add_argument(
+        "--database",
+        help="Benchmark a throwaway copy of this SQLite file instead of seeding "
+        "one; the file itself is left untouched",
+    )
+    parser.add_argument(
+        "--concurrency",
+        default="1,8,32",
+        type=lambda text: [int(level) for level in text.split(",")],
+    )
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds per level")
+    parser.add_argument("--duration", type=float, default=15, help="Seconds per level")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument(
+        "--llm-latency-ms",
+        type=float,
+        help="Median latency of the synthetic LLM (default: LLM_SIM_LATENCY_MS)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here, not stdout")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="soda-bench-") as tmp:
+        database_url = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        if args.database:
+            # The run makes purchases; never write to the caller's file.
+            print("Copying the database...", file=sys.stderr)
+            _copy_database(Path(args.database), Path(tmp) / "bench.db")
+        else:
+            print("Seeding...", file=sys.stderr)
+            spec = SeedSpec(
+                sodas=args.sodas,
+                customers=args.customers,
+                transactions=args.transactions,
+                # Nobody logs in during a run; one hash will do.
+                password_pool=1,
+                seed=args.seed,
+            )
+            seed_database(database_url, spec, log=lambda message: None)
+        data = load_dataset(database_url)
+
+        env = dict(os.environ, DATABASE_URL=database_url)
+        env.setdefault("LLM_BACKEND", "synthetic")
+        env.setdefault("LLM_SIM_SEED", str(args.seed))
+        if args.llm_latency_ms is not None:
+            env["LLM_SIM_LATENCY_MS"] = str(args.llm_latency_ms)
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = start_server(env, port, args.workers)
+        try:
+            levels = []
+            for concurrency in args.concurrency:
+                print(f"Concurrency {concurrency}...", file=sys.stderr)
+                level = asyncio.run(
+                    run_level(
+                        base_url,
+                        data,
+                        args.mix,
+                        concurrency,
+                        args.warmup,
+                        args.duration,
+                        args.seed,
+                    )
+                )
+                print(
+                    f"  {level['throughput_rps']} req/s, p50 {level['p50_ms']} ms,"
+                    f" p99 {level['p99_ms']} ms, {level['errors']} errors",
+                    file=sys.stderr,
+                )
+                levels.append(level)
+            # Per worker process; with several workers this is one of them.
+            server_stats = httpx.get(f"{base_url}/query/stats", timeout=10).json()
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "workers": args.workers,
+            "warmup_s": args.warmup,
+            "duration_s": args.duration,
+            "seed": args.seed,
+            "mix": args.mix,
+            "llm_backend": env["LLM_BACKEND"],
+            "llm_latency_ms": env.get("LLM_SIM_LATENCY_MS"),
+            "dataset": {
+                "sodas": len(data.soda_ids),
+                "customers": len(data.customer_ids),
+                "transactions": data.transactions,
+            },
+        },
+        "levels": levels,
+        "server_stats": server_stats,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""
+Bulk synthetic data for scale-testing the domain model.
+
+Fills an empty database with sodas, customers and their transactions far
+faster than the services would: rows go in with batched executemany
+inserts, secondary indexes are built once at the end, and customers share a
+small pool of precomputed password hashes instead of one bcrypt per row.
+Soda popularity and customer activity follow power laws; timestamps follow
+a daily and weekly rhythm and increase with the transaction id. From
+``src/``::
+
+    python -m benchmarks.seed_data --database big.db \\
+        --customers 500000 --transactions 10000000
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import accumulate, islice, product
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Engine,
+    Index,
+    Table,
+    event,
+    func,
+    insert,
+    select,
+)
+from sqlmodel import SQLModel, create_engine
+
+from domain.models.customer import CustomerDb
+from domain.models.soda import Soda
+from domain.models.transaction_customer import TransactionCustomer
+from utils.hash import hash_password
+
+FLAVORS = tuple(
+    "Cherry Lemon Lime Orange Grape Vanilla Ginger Mango Peach Raspberry Apple"
+    " Pineapple Coconut Mint Blueberry Watermelon Grapefruit Strawberry Kiwi"
+    " Cream".split()
+)
+BASES = ("Cola", "Soda", "Fizz", "Pop", "Tonic", "Spritz", "Ale", "Root Beer")
+STYLES = ("", "Zero", "Light", "Max", "Classic", "Extra")
+FIRST_NAMES = tuple(
+    "Ana Ben Carla David Elena Felix Grace Hugo Iris Jonas Kim Luis Maya Nico Olga"
+    " Pablo Rosa Sam Tara Victor".split()
+)
+LAST_NAMES = tuple(
+    "Garcia Smith Muller Rossi Silva Kowalski Novak Jensen Costa Fischer Moreau"
+    " Lopez Brown Ito Khan".split()
+)
+
+# Relative purchases per hour of the day: quiet nights, a lunch peak and a
+# larger evening one.
+HOURLY_WEIGHTS = (
+    0.2,
+    0.1,
+    0.05,
+    0.05,
+    0.05,
+    0.1,
+    0.3,
+    0.6,
+    0.9,
+    1.0,
+    1.1,
+    1.4,
+    1.8,
+    1.6,
+    1.1,
+    1.0,
+    1.1,
+    1.4,
+    1.9,
+    2.2,
+    2.0,
+    1.5,
+    0.9,
+    0.4,
+)
+# Units per purchase, from 1: mostly singles.
+QUANTITY_WEIGHTS = (70, 12, 8, 4, 3, 3)
+# Monday first; weekends sell a little more.
+WEEKDAY_WEIGHTS = (0.9, 0.9, 0.95, 1.0, 1.1, 1.3, 1.2)
+
+BATCH_SIZE = 20000
+
+
+@dataclass(frozen=True)
+class SeedSpec:
+    sodas: int = 200
+    customers: int = 1000
+    transactions: int = 50000
+    # Transactions are spread over the days before today.
+    days: int = 365
+    # Zipf exponents: the k-th most popular soda sells ~1/k**soda_skew as
+    # much as the first, likewise for how often customers buy.
+    soda_skew: float = 1.1
+    customer_skew: float = 0.8
+    # Distinct bcrypt hashes; customer i's password is "password-{i % pool}".
+    password_pool: int = 16
+    stock: int = 10**9
+    seed: int = 0
+
+
+def soda_names(count: int) -> List[str]:
+    names = [
+        " ".join(part for part in (flavor, base, style) if part)
+        for style, base, flavor in product(STYLES, BASES, FLAVORS)
+    ]
+    # Past every combination, names repeat with a word suffix: a number in
+    # the name would read as a quantity in queries.
+    suffixes = ("", " Special", " Reserve", " Craft")
+    return [
+        names[i % len(names)] + suffixes[(i // len(names)) % len(suffixes)]
+        for i in range(count)
+    ]
+
+
+def zipf_cum_weights(count: int, skew: float) -> List[float]:
+    return list(accumulate(1 / rank**skew for rank in range(1, count + 1)))
+
+
+# Columns filled per table, in the order the row generators yield them.
+SODA_COLUMNS = ("name", "price", "quantity")
+CUSTOMER_COLUMNS = ("name", "email", "password")
+TRANSACTION_COLUMNS = ("timestamp", "quantity", "soda_id", "customer_id")
+
+Row = Tuple[Any, ...]
+
+
+def _soda_rows(spec: SeedSpec, rng: random.Random) -> Iterator[Row]:
+    for name in soda_names(spec.sodas):
+        # Mostly 1-2.5, a few premium ones.
+        price = round(min(9.99, rng.lognormvariate(math.log(1.6), 0.35)), 2)
+        yield name, price, spec.stock
+
+
+def _customer_rows(spec: SeedSpec, hashes: Sequence[str]) -> Iterator[Row]:
+    names = list(product(FIRST_NAMES, LAST_NAMES))
+    for i in range(1, spec.customers + 1):
+        first, last = names[i % len(names)]
+        yield (
+            f"{first} {last}",
+            f"{first.lower()}.{last.lower()}.{i}@example.com",
+            hashes[i % len(hashes)],
+        )
+
+
+def _daily_counts(spec: SeedSpec, start: datetime) -> List[int]:
+    """Transactions per day, summing to ``spec.transactions``."""
+    weights = [
+        WEEKDAY_WEIGHTS[(start + timedelta(days=day)).weekday()]
+        for day in range(spec.days)
+    ]
+    total = sum(weights)
+    counts = [int(spec.transactions * weight / total) for weight in weights]
+    # Rounding leftovers go to the most recent days.
+    for day in range(spec.transactions - sum(counts)):
+        counts[-1 - day % spec.days] += 1
+    return counts
+
+
+def _transaction_rows(
+    spec: SeedSpec, rng: random.Random, now: datetime
+) -> Iterator[Row]:
+    # Popularity ranks are shuffled so the best sellers aren't the first ids.
+    soda_ids = list(range(1, spec.sodas + 1))
+    rng.shuffle(soda_ids)
+    customer_ids = list(range(1, spec.customers + 1))
+    rng.shuffle(customer_ids)
+    soda_weights = zipf_cum_weights(spec.sodas, spec.soda_skew)
+    customer_weights = zipf_cum_weights(spec.customers, spec.customer_skew)
+    hour_weights = list(accumulate(HOURLY_WEIGHTS))
+    quantity_weights = list(accumulate(QUANTITY_WEIGHTS))
+    quantities = range(1, len(QUANTITY_WEIGHTS) + 1)
+
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    start = today - timedelta(days=spec.days)
+    for day, count in enumerate(_daily_counts(spec, start)):
+        midnight = start + timedelta(days=day)
+        offsets = sorted(
+            hour * 3600 + rng.random() * 3600
+            for hour in rng.choices(range(24), cum_weights=hour_weights, k=count)
+        )
+        yield from zip(
+            [midnight + timedelta(seconds=offset) for offset in offsets],
+            rng.choices(quantities, cum_weights=quantity_weights, k=count),
+            rng.choices(soda_ids, cum_weights=soda_weights, k=count),
+            rng.choices(customer_ids, cum_weights=customer_weights, k=count),
+        )
+
+
+def _bind_processor(engine: Engine, column: Column) -> Optional[Callable]:
+    dialect = engine.dialect
+    if dialect.name == "sqlite" and isinstance(column.type, DateTime):
+        # SQLAlchemy's default SQLite DATETIME text, several times cheaper.
+        return lambda value: value.isoformat(" ", "microseconds")
+    return dialect.type_descriptor(column.type).bind_processor(dialect)
+
+
+def _bulk_insert(
+    engine: Engine,
+    table: Table,
+    columns: Sequence[str],
+    rows: Iterator[Row],
+    total: int,
+    log: Callable[[str], None],
+) -> None:
+    """
+    executemany straight on the driver, SQLAlchemy's per-row parameter
+    handling would cost more than the inserts. Values still go through the
+    column types' bind processors (e.g. datetimes to SQLite strings), a
+    column at a time.
+    """
+    dialect = engine.dialect
+    compiled = insert(table).compile(dialect=dialect, column_keys=list(columns))
+    processors = [_bind_processor(engine, table.c[name]) for name in columns]
+    # Driver parameters in the statement's order, or by name.
+    order = [columns.index(name) for name in compiled.positiontup or ()]
+
+    started = time.perf_counter()
+    done = 0
+    with engine.connect() as connection:
+        while True:
+            batch = list(islice(rows, BATCH_SIZE))
+            if not batch:
+                break
+            values = [
+                list(map(process, column)) if process else column
+                for process, column in zip(processors, zip(*batch))
+            ]
+            if dialect.positional:
+                params: List[Any] = list(zip(*(values[i] for i in order)))
+            else:
+                params = [dict(zip(columns, row)) for row in zip(*values)]
+            connection.exec_driver_sql(str(compiled), params)
+            # Committing per batch keeps the journal small on big runs.
+            connection.commit()
+            done += len(batch)
+            elapsed = time.perf_counter() - started
+            if done == total or done % (BATCH_SIZE * 25) == 0:
+                log(f"{table.name}: {done}/{total} ({done / elapsed:,.0f} rows/s)")
+
+
+def _bulk_load_pragmas(dbapi_connection: Any, _connection_record: Any) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # A crash mid-seed means seeding again anyway; skip the fsyncs.
+    cursor.execute("PRAGMA synchronous=OFF")
+    # Negative values are KiB: room for the index builds.
+    cursor.execute("PRAGMA cache_size=-262144")
+    cursor.close()
+
+
+def seed_database(
+    database_url: str,
+    spec: SeedSpec,
+    log: Callable[[str], None] = lambda message: print(message, file=sys.stderr),
+    now: Optional[datetime] = None,
+) -> None:
+    """Seed an empty database (the tables are created if missing)."""
+    rng = random.Random(spec.seed)
+    now = now or datetime.now()
+    engine = create_engine(database_url)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _bulk_load_pragmas)
+    SQLModel.metadata.create_all(engine)
+    tables: List[Table] = [
+        Soda.__table__,  # type: ignore[list-item]
+        CustomerDb.__table__,  # type: ignore[list-item]
+        TransactionCustomer.__table__,  # type: ignore[list-item]
+    ]
+    with engine.connect() as connection:
+        for table in tables:
+            if connection.execute(select(func.count()).select_from(table)).scalar():
+                raise SystemExit(
+                    f"Table {table.name} is not empty; seed a new database"
+                )
+
+    # Building the indexes once at the end beats updating them per row.
+    indexes: List[Index] = [index for table in tables for index in table.indexes]
+    for index in indexes:
+        index.drop(engine, checkfirst=True)
+
+    log(f"Hashing {spec.password_pool} passwords...")
+    hashes = [hash_password(f"password-{i}") for i in range(max(1, spec.password_pool))]
+    _bulk_insert(
+        engine, tables[0], SODA_COLUMNS, _soda_rows(spec, rng), spec.sodas, log
+    )
+    _bulk_insert(
+        engine,
+        tables[1],
+        CUSTOMER_COLUMNS,
+        _customer_rows(spec, hashes),
+        spec.customers,
+        log,
+    )
+    _bulk_insert(
+        engine,
+        tables[2],
+        TRANSACTION_COLUMNS,
+        _transaction_rows(spec, rng, now),
+        spec.transactions,
+        log,
+    )
+
+    for index in indexes:
+        started = time.perf_counter()
+        index.create(engine)
+        log(f"Index {index.name} built in {time.perf_counter() - started:.1f}s")
+    engine.dispose()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    defaults = SeedSpec()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", required=True, help="SQLite file to create")
+    parser.add_argument("--sodas", type=int, default=defaults.sodas)
+    parser.add_argument("--customers", type=int, default=defaults.customers)
+    parser.add_argument("--transactions", type=int, default=defaults.transactions)
+    parser.add_argument("--days", type=int, default=defaults.days)
+    parser.add_argument("--soda-skew", type=float, default=defaults.soda_skew)
+    parser.add_argument("--customer-skew", type=float, default=defaults.customer_skew)
+    parser.add_argument("--password-pool", type=int, default=defaults.password_pool)
+    parser.add_argument("--stock", type=int, default=defaults.stock)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args(argv)
+
+    spec = SeedSpec(
+        sodas=args.sodas,
+        customers=args.customers,
+        transactions=args.transactions,
+        days=max(1, args.days),
+        soda_skew=args.soda_skew,
+        customer_skew=args.customer_skew,
+        password_pool=args.password_pool,
+        stock=args.stock,
+        seed=args.seed,
+    )
+    started = time.perf_counter()
+    seed_database(f"sqlite:///{Path(args.database).resolve()}", spec)
+    print(f"Seeded in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 from os import getenv
 from dotenv import load_dotenv
@@ -15,6 +17,100 @@ class Settings(BaseModel):
     database_url: str = getenv("DATABASE_URL", default="sqlite:///database.db")
     gemini_api_key: str = getenv("GOOGLE_API_KEY", default="your-google-api-key")
 
+    # Database connection settings
+    database_echo: bool = getenv("DATABASE_ECHO", default="false").lower() == "true"
+    database_pool_size: int = int(getenv("DATABASE_POOL_SIZE", default="10"))
+    database_max_overflow: int = int(getenv("DATABASE_MAX_OVERFLOW", default="20"))
+    database_pool_timeout: float = float(getenv("DATABASE_POOL_TIMEOUT", default="30"))
+    database_busy_timeout_ms: int = int(
+        getenv("DATABASE_BUSY_TIMEOUT_MS", default="5000")
+    )
+
+    # Password hashing: bcrypt work factor and the process pool running it
+    bcrypt_rounds: int = int(getenv("BCRYPT_ROUNDS", default="12"))
+    password_hash_workers: int = int(getenv("PASSWORD_HASH_WORKERS", default="2"))
+    password_hash_max_pending: int = int(
+        getenv("PASSWORD_HASH_MAX_PENDING", default="32")
+    )
+
+    # Verified-token cache: skips the customer lookup for known tokens
+    auth_cache_max_entries: int = int(getenv("AUTH_CACHE_MAX_ENTRIES", default="4096"))
+    auth_cache_ttl_seconds: float = float(
+        getenv("AUTH_CACHE_TTL_SECONDS", default="60")
+    )
+
+    # Answer common phrasings locally instead of calling the LLM
+    intent_fast_path_enabled: bool = (
+        getenv("INTENT_FAST_PATH_ENABLED", default="true").lower() == "true"
+    )
+
+    # Read-only actions of a plan that may run at the same time
+    action_read_concurrency: int = int(getenv("ACTION_READ_CONCURRENCY", default="4"))
+
+    # Upper bound for the inventory/customer context sent with each LLM call
+    prompt_context_token_budget: int = int(
+        getenv("PROMPT_CONTEXT_TOKEN_BUDGET", default="1500")
+    )
+
+    # Few-shot examples picked per query from the prompt's examples table
+    prompt_examples_k: int = int(getenv("PROMPT_EXAMPLES_K", default="4"))
+
+    # LLM calls: whole-query deadline, retries within it, hedged requests and
+    # the circuit breaker that fails fast while the LLM keeps erroring
+    query_timeout_seconds: float = float(getenv("QUERY_TIMEOUT_SECONDS", default="20"))
+    llm_max_attempts: int = int(getenv("LLM_MAX_ATTEMPTS", default="3"))
+    llm_retry_backoff_seconds: float = float(
+        getenv("LLM_RETRY_BACKOFF_SECONDS", default="0.5")
+    )
+    llm_hedge_enabled: bool = (
+        getenv("LLM_HEDGE_ENABLED", default="false").lower() == "true"
+    )
+    llm_hedge_min_samples: int = int(getenv("LLM_HEDGE_MIN_SAMPLES", default="20"))
+    llm_breaker_window: int = int(getenv("LLM_BREAKER_WINDOW", default="20"))
+    llm_breaker_min_calls: int = int(getenv("LLM_BREAKER_MIN_CALLS", default="10"))
+    llm_breaker_failure_rate: float = float(
+        getenv("LLM_BREAKER_FAILURE_RATE", default="0.5")
+    )
+    llm_breaker_cooldown_seconds: float = float(
+        getenv("LLM_BREAKER_COOLDOWN_SECONDS", default="30")
+    )
+
+    # Optional micro-batching: queries arriving within the window share one
+    # LLM call
+    llm_batch_enabled: bool = (
+        getenv("LLM_BATCH_ENABLED", default="false").lower() == "true"
+    )
+    llm_batch_window_ms: float = float(getenv("LLM_BATCH_WINDOW_MS", default="50"))
+    llm_batch_max_size: int = int(getenv("LLM_BATCH_MAX_SIZE", default="16"))
+
+    # Which LLM answers planning calls: "gemini"; "record" or "replay" against
+    # the cassette file; or "synthetic", which makes up plans from the prompt
+    # with the latency and error rate below, for load testing offline
+    llm_backend: str = getenv("LLM_BACKEND", default="gemini").lower()
+    llm_cassette_path: str = getenv("LLM_CASSETTE_PATH", default="llm_cassette.jsonl")
+    llm_sim_latency_ms: float = float(getenv("LLM_SIM_LATENCY_MS", default="800"))
+    llm_sim_latency_sigma: float = float(getenv("LLM_SIM_LATENCY_SIGMA", default="0.4"))
+    llm_sim_error_rate: float = float(getenv("LLM_SIM_ERROR_RATE", default="0"))
+    llm_sim_seed: Optional[int] = (
+        int(getenv("LLM_SIM_SEED", default="")) if getenv("LLM_SIM_SEED") else None
+    )
+
+    # Action-plan cache settings
+    plan_cache_max_entries: int = int(getenv("PLAN_CACHE_MAX_ENTRIES", default="1024"))
+    plan_cache_ttl_seconds: float = float(
+        getenv("PLAN_CACHE_TTL_SECONDS", default="300")
+    )
+
+    # Previewed plans kept for /query/actions
+    plan_store_max_entries: int = int(getenv("PLAN_STORE_MAX_ENTRIES", default="1024"))
+    plan_store_ttl_seconds: float = float(
+        getenv("PLAN_STORE_TTL_SECONDS", default="600")
+    )
+
+    # Prometheus metrics at /metrics, with per-route, per-service-method and
+    # per-query timing
+    metrics_enabled: bool = getenv("METRICS_ENABLED", default="true").lower() == "true"
+
     # testing: bool = getenv("TESTING", default=False, cast=bool)
 
 
@@ -1,5 +1,6 @@
+from datetime import datetime
 from enum import Enum
-from typing import List, Union
+from typing import List, Optional, Union
 from pydantic import BaseModel, Field
 
 # if TYPE_CHECKING:
@@ -74,6 +75,14 @@ class TransactionHistoryAction(BaseModel):
     customer: CustomerBase = Field(
         description="The customer whose transaction history is being requested. If you cannot find the customer_id just get the customer name.",
     )
+    since: Optional[datetime] = Field(
+        default=None,
+        description="Start of the requested time window, resolved from relative dates ('yesterday', 'last week') using the current time. Leave as `None` when the user gives no time frame.",
+    )
+    until: Optional[datetime] = Field(
+        default=None,
+        description="End of the requested time window (exclusive). Leave as `None` for 'up to now'.",
+    )
 
 
 class GeneralAction(BaseModel):
@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import TYPE_CHECKING, Optional
 
+from sqlalchemy import Index
 from sqlmodel import Field, Relationship, SQLModel
 from pydantic.json_schema import SkipJsonSchema
 
@@ -10,6 +11,14 @@ if TYPE_CHECKING:
 
 
 class TransactionCustomer(SQLModel, table=True):
+    # History is always read per customer (or per soda) over a time range.
+    __table_args__ = (
+        Index(
+            "ix_transaction_customer_customer_timestamp", "customer_id", "timestamp"
+        ),
+        Index("ix_transaction_customer_soda_timestamp", "soda_id", "timestamp"),
+    )
+
     id: Optional[int] = Field(
         description="The unique database ID for this transaction. The system will generate this.",
         default=None,
@@ -1,16 +1,286 @@
-import os
+import time
+from contextlib import contextmanager
+from typing import (
+    Annotated,
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Sequence,
+    TypeVar,
+)
+
+from fastapi import Depends
+from sqlalchemy import Engine, event, tuple_
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
 from sqlmodel import SQLModel, create_engine, Session
 
 from config import CONFIG
+from domain.models.app import AppResponse
+from utils.metrics import current_operation, metrics
+
+
+def _create_engine(database_url: str) -> Engine:
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(
+            url,
+            echo=CONFIG.database_echo,
+            pool_size=CONFIG.database_pool_size,
+            max_overflow=CONFIG.database_max_overflow,
+            pool_timeout=CONFIG.database_pool_timeout,
+            pool_pre_ping=True,
+        )
+
+    # Connections are handed between FastAPI's worker threads, so the
+    # pysqlite same-thread guard has to be off; the pool makes sure a
+    # connection is only ever used by one session at a time.
+    connect_args = {
+        "check_same_thread": False,
+        "timeout": CONFIG.database_busy_timeout_ms / 1000,
+    }
+    if url.database in (None, "", ":memory:"):
+        # Every connection to ":memory:" is a different database, so share one.
+        return create_engine(
+            url,
+            echo=CONFIG.database_echo,
+            connect_args=connect_args,
+            poolclass=StaticPool,
+        )
+
+    return create_engine(
+        url,
+        echo=CONFIG.database_echo,
+        connect_args=connect_args,
+        pool_size=CONFIG.database_pool_size,
+        max_overflow=CONFIG.database_max_overflow,
+        pool_timeout=CONFIG.database_pool_timeout,
+    )
+
+
+engine = _create_engine(CONFIG.database_url)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection: Any, _connection_record: Any) -> None:
+    """Apply per-connection pragmas as soon as the pool opens a connection."""
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers run concurrently with the single writer.
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # NORMAL is durable across application crashes in WAL mode and avoids an
+    # fsync on every commit.
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={CONFIG.database_busy_timeout_ms}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    # Negative values are KiB: ~16 MiB page cache per connection.
+    cursor.execute("PRAGMA cache_size=-16000")
+    cursor.close()
+    # pysqlite opens transactions itself, and only before DML: a SAVEPOINT
+    # taken before any write becomes the outermost transaction and its
+    # RELEASE commits. Take transaction control away from it (below).
+    dbapi_connection.isolation_level = None
+
+
+_BEGIN_PENDING_KEY = "sqlite_begin_pending"
+
+
+@event.listens_for(engine, "begin")
+def _begin_sqlite_transaction(connection: Any) -> None:
+    """
+    Mark the transaction as started; BEGIN itself waits for the first write
+    or savepoint (_emit_begin). Reads before it run on their own, as pysqlite
+    would run them: a deferred BEGIN up front would pin a read snapshot, and
+    the first write would then fail with "database is locked" whenever
+    another writer committed in between.
+    """
+    if engine.dialect.name == "sqlite":
+        connection.info[_BEGIN_PENDING_KEY] = True
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _emit_begin(
+    connection: Any, cursor: Any, statement: str, *_args: Any, **_kwargs: Any
+) -> None:
+    if not connection.info.get(_BEGIN_PENDING_KEY):
+        return
+    if statement.lstrip()[:6].upper() in ("SELECT", "PRAGMA"):
+        return
+    connection.info[_BEGIN_PENDING_KEY] = False
+    # IMMEDIATE takes the write lock now, waiting up to busy_timeout for it.
+    cursor.execute("BEGIN IMMEDIATE")
+
+
+@event.listens_for(engine, "commit")
+@event.listens_for(engine, "rollback")
+def _end_sqlite_transaction(connection: Any) -> None:
+    connection.info.pop(_BEGIN_PENDING_KEY, None)
+
+
+db_query_duration = metrics.histogram(
+    "db_query_duration_seconds",
+    "Duration of database statements, per service method issuing them",
+    ("service", "method"),
+)
+
+
+def _query_started(
+    _conn: Any, _cursor: Any, _statement: Any, _params: Any, context: Any, _many: Any
+) -> None:
+    context._metrics_started = time.perf_counter()
+
+
+def _query_finished(
+    _conn: Any, _cursor: Any, _statement: Any, _params: Any, context: Any, _many: Any
+) -> None:
+    started = getattr(context, "_metrics_started", None)
+    if started is not None:
+        db_query_duration.observe(time.perf_counter() - started, *current_operation())
 
 
-engine = create_engine(CONFIG.database_url, echo=True)
+if CONFIG.metrics_enabled:
+    event.listen(engine, "before_cursor_execute", _query_started)
+    event.listen(engine, "after_cursor_execute", _query_finished)
+
+
+def paginate(
+    statement: Any, id_column: Any, limit: Optional[int], after_id: Optional[int]
+) -> Any:
+    """Keyset-paginate ``statement`` on ``id_column``: stable and index-only."""
+    return paginate_keyset(
+        statement,
+        (id_column,),
+        limit,
+        (after_id,) if after_id is not None else None,
+    )
+
+
+def paginate_keyset(
+    statement: Any,
+    key_columns: Sequence[Any],
+    limit: Optional[int],
+    after: Optional[Sequence[Any]],
+) -> Any:
+    """
+    Keyset-paginate ``statement`` on a unique, composite ``key_columns``;
+    ``after`` is the key of the last row of the previous page. Pick the
+    columns of the index serving the query so pages come without a sort.
+    """
+    statement = statement.order_by(*key_columns)
+    if after is not None:
+        if len(key_columns) == 1:
+            statement = statement.where(key_columns[0] > after[0])
+        else:
+            statement = statement.where(tuple_(*key_columns) > tuple_(*after))
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
 
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    # create_all skips tables that already exist, so indexes added to a model
+    # later would never reach an existing database.
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+def new_session() -> Session:
+    # Objects are handed back to the controllers after commit, so keep their
+    # loaded state instead of expiring it and re-querying on serialization.
+    return Session(engine, expire_on_commit=False)
 
 
-def get_session():
-    with Session(engine) as session:
+def get_session() -> Generator[Session, None, None]:
+    with new_session() as session:
         yield session
+
+
+# A StaticPool hands the same connection to every session, so sessions must
+# not be used from several threads at once.
+supports_concurrent_sessions = not isinstance(engine.pool, StaticPool)
+
+# Rows fetched per round trip when streaming a table with a server-side cursor.
+STREAM_BATCH_SIZE = 500
+
+
+SessionDep = Annotated[Session, Depends(get_session)]
+
+
+T = TypeVar("T")
+
+_UNIT_OF_WORK_KEY = "unit_of_work"
+
+
+class UnitOfWork:
+    """
+    Runs several service calls in one database transaction of the request
+    session. Each call gets its own session inside a SAVEPOINT, so the
+    services' own commit/rollback only release or undo their part; nothing
+    is durable until the unit of work commits once at the end.
+    """
+
+    def __init__(self, db_session: Session):
+        self._db_session = db_session
+        # The first savepoint emits BEGIN (see _emit_begin), so they all nest
+        # in one transaction instead of each RELEASE committing on its own.
+        self._connection = db_session.connection()
+        self._after_commit: List[Callable[[], None]] = []
+        # Scratch space for services to keep state for this unit of work.
+        self.info: Dict[str, Any] = {}
+
+    @staticmethod
+    def of(db_session: Session) -> Optional["UnitOfWork"]:
+        """The unit of work ``db_session`` belongs to, if any."""
+        return db_session.info.get(_UNIT_OF_WORK_KEY)
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """Run ``callback`` once the unit of work has committed."""
+        if callback not in self._after_commit:
+            self._after_commit.append(callback)
+
+    def run(self, work: Callable[[Session], AppResponse[T]]) -> AppResponse[T]:
+        """
+        Run ``work`` in a savepoint that is rolled back if it returns an error
+        or raises, and kept otherwise.
+        """
+        savepoint = self._connection.begin_nested()
+        try:
+            with Session(
+                bind=self._connection,
+                join_transaction_mode="create_savepoint",
+                expire_on_commit=False,
+                info={_UNIT_OF_WORK_KEY: self},
+            ) as session:
+                response = work(session)
+        except BaseException:
+            savepoint.rollback()
+            raise
+        if response.error:
+            savepoint.rollback()
+        else:
+            savepoint.commit()
+        return response
+
+    def _commit(self) -> None:
+        self._db_session.commit()
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            callback()
+
+
+@contextmanager
+def unit_of_work(db_session: Session) -> Generator[UnitOfWork, None, None]:
+    """Commit everything run through the unit of work once, or nothing on error."""
+    work = UnitOfWork(db_session)
+    try:
+        yield work
+    except BaseException:
+        db_session.rollback()
+        raise
+    work._commit()
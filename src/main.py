@@ -2,8 +2,11 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from web.controllers import customer, user_query, soda, transaction_customer
+from config import CONFIG
+from web.controllers import customer, metrics, user_query, soda, transaction_customer
+from web.metrics import MetricsMiddleware
 from infra.db.sqlite import create_db_and_tables
+from utils.hash import password_hasher
 
 
 @asynccontextmanager
@@ -12,6 +15,7 @@ async def lifespan(app: FastAPI):
     print("App start")
     create_db_and_tables()
     yield
+    password_hasher.shutdown()
     print("App shutdown")
 
 
@@ -31,11 +35,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if CONFIG.metrics_enabled:
+    # Added last so it wraps everything, CORS preflights included.
+    app.add_middleware(MetricsMiddleware)
+
 # app.include_router(auth.router)
 app.include_router(customer.router)
 app.include_router(soda.router)
 app.include_router(transaction_customer.router)
 app.include_router(user_query.router)
+if CONFIG.metrics_enabled:
+    app.include_router(metrics.router)
 print("Routers:")
 for r in app.routes:
 
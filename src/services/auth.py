@@ -1,42 +1,86 @@
+import math
+import threading
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Annotated, Optional
+from hashlib import sha256
+from typing import Annotated, Dict, Optional, Tuple
 from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 import jwt
 
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlmodel import Session
 
 from config import CONFIG
 from domain.models.customer import CustomerDb
 from domain.models.auth import AccessToken, TokenData
 from .customer import customer_service, CustomerService
-from utils.hash import verify_password
-
+from utils.cache import TTLCache
+from utils.hash import password_hasher
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 ACCESS_TOKEN_EXPIRES = timedelta(minutes=30)
 REFRESH_TOKEN_EXPIRES = timedelta(days=7)
 ALGORITHM = "HS256"
 
+PrincipalEntry = Tuple[int, int, float, CustomerDb]
+
 
 class AuthService:
     def __init__(self, customer_service: CustomerService) -> None:
         self.customer_service = customer_service
+        # sha256(token) -> (customer id, customer generation, exp, customer)
+        self.principal_cache: TTLCache[str, PrincipalEntry] = TTLCache(
+            max_entries=CONFIG.auth_cache_max_entries,
+            ttl_seconds=CONFIG.auth_cache_ttl_seconds,
+        )
+        # Bumped on every change to a customer; cached principals of an older
+        # generation are stale.
+        self._customer_generations: Dict[int, int] = {}
+        self._generations_lock = threading.Lock()
+        customer_service.on_customer_change(self._customer_changed)
 
-    def authenticate_user(self, email: str, password: str) -> Optional[CustomerDb]:
-        user_response = self.customer_service.get_customer_by_email(email)
-        if not user_response.data:
+    async def authenticate_user(
+        self, db_session: Session, email: str, password: str
+    ) -> Optional[CustomerDb]:
+        """
+        Check the password in the hashing pool; may raise PasswordHasherBusy.
+        Hashes made with an outdated work factor are replaced on success.
+        """
+        user_response = await run_in_threadpool(
+            self.customer_service.get_customer_by_email, db_session, email
+        )
+        user = user_response.data
+        if not user or user.id is None:
             return None
-        if not verify_password(password, user_response.data.password):
+        valid, new_hash = await password_hasher.verify_and_update(
+            password, user.password
+        )
+        if not valid:
             return None
-        return user_response.data
+        if new_hash:
+            await run_in_threadpool(
+                self.customer_service.update_customer,
+                db_session,
+                customer_id=user.id,
+                hashed_password=new_hash,
+            )
+        return user
 
-    def create_access_token(self, data: TokenData):
-        return jwt.encode(
-            data.model_dump(), CONFIG.authjwt_secret_key, algorithm="HS256"
-        )
+    def create_access_token(
+        self, data: TokenData, expires_delta: timedelta = ACCESS_TOKEN_EXPIRES
+    ) -> str:
+        # pyjwt rejects the token on decode once the exp claim has passed.
+        claims = {
+            **data.model_dump(),
+            "exp": datetime.now(timezone.utc) + expires_delta,
+        }
+        return jwt.encode(claims, CONFIG.authjwt_secret_key, algorithm=ALGORITHM)
 
-    def login(self, email: str, password: str) -> Optional[AccessToken]:
-        user = self.authenticate_user(email, password)
+    async def login(
+        self, db_session: Session, email: str, password: str
+    ) -> Optional[AccessToken]:
+        user = await self.authenticate_user(db_session, email, password)
         if not user:
             return None
         exp = datetime.now() + ACCESS_TOKEN_EXPIRES
@@ -45,29 +89,53 @@ class AuthService:
         )
         return AccessToken(token=access_token, exp=exp)
 
-    def validate_token(self, token: AccessToken) -> Optional[CustomerDb]:
+    def validate_token(
+        self, db_session: Session, token: AccessToken
+    ) -> Optional[CustomerDb]:
         if not token.exp:
             return None
         if token.exp < datetime.now():
             return None
 
+        cache_key = sha256(token.token.encode()).hexdigest()
+        cached = self.principal_cache.get(cache_key)
+        if cached is not None:
+            customer_id, generation, expires_at, customer = cached
+            if (
+                expires_at > time.time()
+                and self._customer_generations.get(customer_id, 0) == generation
+            ):
+                return customer
+
         try:
-            payload = TokenData(
-                **jwt.decode(
-                    token.token, CONFIG.authjwt_secret_key, algorithms=ALGORITHM
-                )
+            claims = jwt.decode(
+                token.token, CONFIG.authjwt_secret_key, algorithms=[ALGORITHM]
             )
+            payload = TokenData(**claims)
             id = payload.customer_id
             if id is None:
                 return None
         except jwt.InvalidTokenError:
             return None
 
-        customer = self.customer_service.get_customer_by_id(customer_id=id)
+        # Read the generation first so a change racing the lookup is not cached
+        # as current.
+        generation = self._customer_generations.get(id, 0)
+        customer = self.customer_service.get_customer_by_id(db_session, customer_id=id)
         if not customer.data:
             return None
 
+        # Tokens issued before exp was added stay valid; cache them for the TTL.
+        expires_at = float(claims.get("exp", math.inf))
+        principal = CustomerDb(**customer.data.model_dump())
+        self.principal_cache.set(cache_key, (id, generation, expires_at, principal))
         return customer.data
 
+    def _customer_changed(self, customer_id: int) -> None:
+        with self._generations_lock:
+            self._customer_generations[customer_id] = (
+                self._customer_generations.get(customer_id, 0) + 1
+            )
+
 
 auth_service = AuthService(customer_service=customer_service)
@@ -1,41 +1,51 @@
-from typing import List, Optional, Sequence
+from typing import Callable, Iterator, List, Optional, Sequence
 
-from sqlmodel import Session, select
+from sqlmodel import Session, col, select
 
 from domain.models.app import AppResponse, ErrorDetail
 from domain.models.customer import CustomerBase, CustomerDb
-from infra.db.sqlite import get_session
-from utils.hash import hash_password
+from infra.db.sqlite import STREAM_BATCH_SIZE, paginate
+from utils.metrics import instrument_service
 
 
+@instrument_service
 class CustomerService:
-    def __init__(self, db_session: Session):
+    def __init__(self):
         print("Created CustomerService")
-        self.db_session = db_session
+        self._customer_listeners: List[Callable[[int], None]] = []
+
+    def on_customer_change(self, listener: Callable[[int], None]) -> None:
+        """Register a callback invoked with a customer's id after it changes."""
+        self._customer_listeners.append(listener)
+
+    def _customer_changed(self, customer_id: int) -> None:
+        for listener in self._customer_listeners:
+            listener(customer_id)
 
     def create_customer(
-        self, name: str, email: str, password: str
+        self, db_session: Session, name: str, email: str, hashed_password: str
     ) -> AppResponse[CustomerDb]:
+        """Store a new customer; hash the password first with utils.hash."""
         try:
-            existing_customer_response = self.get_customer_by_email(email)
+            existing_customer_response = self.get_customer_by_email(db_session, email)
             if existing_customer_response.data:
                 return AppResponse(
                     error=ErrorDetail(message="Email already exists", cause="conflict")
                 )
 
-            customer = CustomerDb(
-                name=name, email=email, password=hash_password(password)
-            )
-            self.db_session.add(customer)
-            self.db_session.commit()
-            self.db_session.refresh(customer)
+            customer = CustomerDb(name=name, email=email, password=hashed_password)
+            db_session.add(customer)
+            db_session.commit()
+            db_session.refresh(customer)
             return AppResponse(data=customer)
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
-    def get_customer_by_id(self, customer_id: int) -> AppResponse[CustomerDb]:
+    def get_customer_by_id(
+        self, db_session: Session, customer_id: int
+    ) -> AppResponse[CustomerDb]:
         try:
-            customer = self.db_session.get(CustomerDb, customer_id)
+            customer = db_session.get(CustomerDb, customer_id)
             if not customer:
                 return AppResponse(
                     error=ErrorDetail(message="Customer not found", cause="not-found")
@@ -44,29 +54,53 @@ class CustomerService:
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
-    def get_customer_by_email(self, email: str) -> AppResponse[CustomerDb]:
+    def get_customer_by_email(
+        self, db_session: Session, email: str
+    ) -> AppResponse[CustomerDb]:
         try:
             statement = select(CustomerDb).where(CustomerDb.email == email)
-            customer = self.db_session.exec(statement).first()
+            customer = db_session.exec(statement).first()
             return AppResponse(data=customer)
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
-    def get_all_customers(self) -> AppResponse[Sequence[CustomerBase]]:
+    def get_all_customers(
+        self,
+        db_session: Session,
+        limit: Optional[int] = None,
+        after_id: Optional[int] = None,
+    ) -> AppResponse[Sequence[CustomerBase]]:
         try:
-            statement = select(CustomerDb)
-            customers = self.db_session.exec(statement).all()
+            statement = paginate(
+                select(CustomerDb), col(CustomerDb.id), limit=limit, after_id=after_id
+            )
+            customers = db_session.exec(statement).all()
             return AppResponse(
                 data=[CustomerBase(**customer.model_dump()) for customer in customers]
             )
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
+    def iter_customers(self, db_session: Session) -> Iterator[CustomerBase]:
+        """Every customer in id order, fetched in batches from one cursor."""
+        statement = (
+            select(CustomerDb)
+            .order_by(col(CustomerDb.id))
+            .execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+        for customer in db_session.exec(statement):
+            yield CustomerBase(**customer.model_dump())
+
     def update_customer(
-        self, customer_id: int, name: Optional[str] = None, email: Optional[str] = None
+        self,
+        db_session: Session,
+        customer_id: int,
+        name: Optional[str] = None,
+        email: Optional[str] = None,
+        hashed_password: Optional[str] = None,
     ) -> AppResponse[CustomerDb]:
         try:
-            customer_response = self.get_customer_by_id(customer_id)
+            customer_response = self.get_customer_by_id(db_session, customer_id)
             if customer_response.error:
                 return customer_response
 
@@ -77,25 +111,31 @@ class CustomerService:
                 customer.name = name
             if email is not None:
                 customer.email = email
-            self.db_session.add(customer)
-            self.db_session.commit()
-            self.db_session.refresh(customer)
+            if hashed_password is not None:
+                customer.password = hashed_password
+            db_session.add(customer)
+            db_session.commit()
+            db_session.refresh(customer)
+            self._customer_changed(customer_id)
             return AppResponse(data=customer)
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
-    def delete_customer(self, customer_id: int) -> AppResponse[bool]:
+    def delete_customer(
+        self, db_session: Session, customer_id: int
+    ) -> AppResponse[bool]:
         try:
-            customer_response = self.get_customer_by_id(customer_id)
+            customer_response = self.get_customer_by_id(db_session, customer_id)
             if customer_response.error:
                 return AppResponse(error=customer_response.error)
 
             customer = customer_response.data
-            self.db_session.delete(customer)
-            self.db_session.commit()
+            db_session.delete(customer)
+            db_session.commit()
+            self._customer_changed(customer_id)
             return AppResponse(data=True)
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
 
-customer_service = CustomerService(db_session=next(get_session()))
+customer_service = CustomerService()
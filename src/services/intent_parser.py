@@ -0,0 +1,171 @@
+import re
+import threading
+from typing import Dict, List, Optional, Union
+
+from pydantic import BaseModel
+
+from domain.models.action import (
+    GeneralAction,
+    InventoryManagementAction,
+    InventoryOperation,
+    PurchaseAction,
+    UserActions,
+    UserIntent,
+)
+from domain.models.soda import Soda
+from services.soda_name_index import SodaNameIndex
+from utils.text import normalize_text
+
+NUMBER_WORDS: Dict[str, int] = {
+    "a": 1,
+    "an": 1,
+    "one": 1,
+    "two": 2,
+    "three": 3,
+    "four": 4,
+    "five": 5,
+    "six": 6,
+    "seven": 7,
+    "eight": 8,
+    "nine": 9,
+    "ten": 10,
+    "eleven": 11,
+    "twelve": 12,
+    "a dozen": 12,
+    "a couple of": 2,
+    "a couple": 2,
+}
+
+_QUANTITY = (
+    r"(?P<quantity>\d+|"
+    + "|".join(re.escape(word) for word in sorted(NUMBER_WORDS, key=len, reverse=True))
+    + r")"
+)
+_SODA = r"(?P<soda>[a-z0-9][a-z0-9 '&.-]*?)"
+_PURCHASE_PREFIX = (
+    r"(?:i want(?: to buy)?|i'd like(?: to buy)?|i would like(?: to buy)?"
+    r"|can i (?:get|have|buy)|could i (?:get|have|buy)|may i (?:get|have)"
+    r"|give me|get me|i'll take|i will take|i'll have|i will have|buy|i'll buy)"
+)
+
+# A purchase either starts with an explicit verb phrase ("can i get a sprite")
+# or is a bare quantity plus product ("two fantas").
+_PURCHASE = re.compile(
+    rf"^(?:{_PURCHASE_PREFIX} )?{_QUANTITY} {_SODA}(?: cans?| bottles?)?$"
+)
+_PURCHASE_NO_QUANTITY = re.compile(rf"^{_PURCHASE_PREFIX} (?:some )?{_SODA}$")
+_STOCK_CHECKS = [
+    re.compile(
+        rf"^how many {_SODA} (?:do you have(?: left| in stock)?"
+        r"|are (?:there )?left|are in stock|are available|left)$"
+    ),
+    re.compile(rf"^what(?:'s| is) the stock(?: level)? (?:for|of) {_SODA}$"),
+    re.compile(rf"^do you have(?: any)? {_SODA}$"),
+]
+_GREETING = re.compile(
+    r"^(?:hi|hello|hey|hiya|howdy|good (?:morning|afternoon|evening))(?: there)?$"
+)
+_THANKS = re.compile(
+    r"^(?:thanks|thank you|thx|ty|cheers)(?: (?:very|so) much| a lot)?$"
+)
+_CLAUSE_SEPARATOR = re.compile(r"\s*(?:,|\band\b|\bplus\b)\s*")
+_POLITENESS = re.compile(r"^(?:please |ok |okay )|(?: please)$")
+# Drop punctuation but keep what appears inside product names ("dr. pepper",
+# "coca-cola", "a&w").
+_PUNCTUATION = re.compile(r"[^\w\s'&.-]|(?<!\w)\.|\.(?!\w)")
+
+GREETING_MESSAGE = "Hello! :)"
+THANKS_MESSAGE = "Thank you! I'm here to help you."
+
+ParsedAction = Union[PurchaseAction, InventoryManagementAction, GeneralAction]
+
+
+class IntentParserStats(BaseModel):
+    matched: int = 0
+    fallbacks: int = 0
+
+
+class IntentParser:
+    """
+    Rule-based parser for the handful of phrasings that make up most of the
+    traffic ("buy 2 cokes", "how many sprites are left", greetings, thanks).
+
+    It only answers when every clause of the input matches a rule and every
+    product resolves to exactly one soda of the catalog; anything else returns
+    ``None`` so the caller falls back to the LLM. Products are looked up in the
+    inventory snapshot's name index, built once per snapshot version.
+    """
+
+    def __init__(self):
+        self._stats = IntentParserStats()
+        self._lock = threading.Lock()
+
+    def parse(self, query: str, names: SodaNameIndex) -> Optional[UserActions]:
+        actions = self._parse(query, names)
+        with self._lock:
+            if actions is None:
+                self._stats.fallbacks += 1
+            else:
+                self._stats.matched += 1
+        return UserActions(actions=actions) if actions else None
+
+    def stats(self) -> IntentParserStats:
+        with self._lock:
+            return self._stats.model_copy()
+
+    def _parse(self, query: str, names: SodaNameIndex) -> Optional[List]:
+        actions: List[ParsedAction] = []
+        for clause in _CLAUSE_SEPARATOR.split(normalize_text(query)):
+            clause = " ".join(_PUNCTUATION.sub(" ", clause).split())
+            clause = _POLITENESS.sub("", clause)
+            if not clause:
+                continue
+            action = self._parse_clause(clause, names)
+            if action is None:
+                return None
+            actions.append(action)
+        return actions or None
+
+    def _parse_clause(
+        self, clause: str, names: SodaNameIndex
+    ) -> Optional[ParsedAction]:
+        if _GREETING.match(clause):
+            return GeneralAction(intent=UserIntent.GREETING, message=GREETING_MESSAGE)
+        if _THANKS.match(clause):
+            return GeneralAction(intent=UserIntent.GREETING, message=THANKS_MESSAGE)
+
+        for pattern in _STOCK_CHECKS:
+            match = pattern.match(clause)
+            if not match:
+                continue
+            soda = names.exact(match.group("soda"))
+            if soda is None:
+                return None
+            return InventoryManagementAction(
+                operation=InventoryOperation.READ,
+                soda=Soda(id=soda.id, name=soda.name, price=0, quantity=0),
+            )
+
+        match = _PURCHASE.match(clause)
+        if match:
+            quantity = self._quantity(match.group("quantity"))
+            soda = names.exact(match.group("soda"))
+            if soda is None or quantity is None or quantity < 1:
+                return None
+            return PurchaseAction(soda_name=soda.name, quantity=quantity)
+
+        match = _PURCHASE_NO_QUANTITY.match(clause)
+        if match:
+            soda = names.exact(match.group("soda"))
+            if soda is None:
+                return None
+            return PurchaseAction(soda_name=soda.name, quantity=1)
+        return None
+
+    def _quantity(self, token: str) -> Optional[int]:
+        if token.isdigit():
+            return int(token)
+        return NUMBER_WORDS.get(token)
+
+
+intent_parser = IntentParser()
@@ -0,0 +1,391 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Type
+
+import google.generativeai as genai
+import instructor
+from instructor.process_response import handle_response_model
+from pydantic import BaseModel
+
+from config import CONFIG, Settings
+from services.llm_plan import (
+    ActionStreamParser,
+    LlmActionType,
+    LlmBatchItem,
+    LlmBatchPlan,
+    LlmCustomer,
+    LlmGeneralAction,
+    LlmPlan,
+    LlmPurchaseAction,
+    LlmTransactionHistoryAction,
+)
+from services.prompt_context import (
+    CUSTOMER_HEADER,
+    REQUESTS_HEADER,
+    SODA_HEADER,
+    estimate_tokens,
+)
+
+Messages = List[Dict[str, str]]
+
+
+class LlmUsageStats(BaseModel):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+class LlmBackend(ABC):
+    """
+    What answers planning calls. ``create`` returns an instance of
+    ``response_model`` (LlmPlan or LlmBatchPlan); ``stream`` yields the
+    actions of an LlmPlan as they are produced.
+    """
+
+    name: str
+
+    def __init__(self) -> None:
+        self._usage = LlmUsageStats()
+        self._usage_lock = threading.Lock()
+
+    def usage(self) -> LlmUsageStats:
+        """Tokens spent so far, as reported by the model."""
+        with self._usage_lock:
+            return self._usage.model_copy()
+
+    def _record_usage(self, prompt_tokens: int, completion_tokens: int) -> None:
+        with self._usage_lock:
+            self._usage.prompt_tokens += prompt_tokens
+            self._usage.completion_tokens += completion_tokens
+
+    def _record_gemini_usage(self, usage_metadata: Any) -> None:
+        if usage_metadata is not None:
+            self._record_usage(
+                usage_metadata.prompt_token_count or 0,
+                usage_metadata.candidates_token_count or 0,
+            )
+
+    @abstractmethod
+    async def create(
+        self, messages: Messages, response_model: Type[BaseModel], **kwargs
+    ) -> Any: ...
+
+    @abstractmethod
+    def stream(self, messages: Messages, **kwargs) -> AsyncIterator[LlmActionType]: ...
+
+
+class GeminiBackend(LlmBackend):
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = "models/gemini-2.5-flash"):
+        super().__init__()
+        genai.configure(api_key=api_key)  # type: ignore
+        self.model = genai.GenerativeModel(  # type: ignore
+            model_name=model_name,
+            # model_name="models/gemini-2.5-pro",
+        )
+        self.client = instructor.from_gemini(
+            client=self.model,
+            mode=instructor.Mode.GEMINI_JSON,
+            use_async=True,
+        )
+
+    async def create(
+        self, messages: Messages, response_model: Type[BaseModel], **kwargs
+    ) -> Any:
+        result, completion = await self.client.messages.create_with_completion(
+            messages=messages, response_model=response_model, **kwargs
+        )
+        self._record_gemini_usage(getattr(completion, "usage_metadata", None))
+        return result
+
+    async def stream(
+        self, messages: Messages, **kwargs
+    ) -> AsyncIterator[LlmActionType]:
+        """
+        instructor's async streaming drops GEMINI_JSON chunks, so only its
+        prompt preparation (schema and message conversion) is used here.
+        """
+        _, request = handle_response_model(
+            LlmPlan, mode=instructor.Mode.GEMINI_JSON, messages=messages, **kwargs
+        )
+        parser = ActionStreamParser()
+        response = await self.model.generate_content_async(stream=True, **request)
+        usage_metadata = None
+        async for chunk in response:
+            # Every chunk carries the running totals.
+            usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+            for action in parser.feed(chunk.text):
+                yield action
+        self._record_gemini_usage(usage_metadata)
+
+
+class CassetteMiss(LookupError):
+    """A replayed request that was never recorded."""
+
+
+class CassetteBackend(LlmBackend):
+    """
+    Replays responses recorded in a JSON-lines file. In "record" mode
+    requests missing from it go to ``inner`` and are appended; in "replay"
+    mode they raise CassetteMiss. Requests are matched on the response model
+    and the messages, minus the current time line of the prompt context.
+    A streamed plan is recorded and replayed like a created LlmPlan.
+    """
+
+    RECORD = "record"
+    REPLAY = "replay"
+
+    def __init__(self, path: str, mode: str, inner: Optional[LlmBackend] = None):
+        if mode not in (self.RECORD, self.REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if mode == self.RECORD and inner is None:
+            raise ValueError("Recording needs a backend to record")
+        super().__init__()
+        self.name = f"cassette-{mode}"
+        self.path = Path(path)
+        self.mode = mode
+        self.inner = inner
+        self._responses: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with self.path.open(encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._responses[record["key"]] = record["response"]
+
+    async def create(
+        self, messages: Messages, response_model: Type[BaseModel], **kwargs
+    ) -> Any:
+        key = self._key(response_model, messages)
+        response = self._responses.get(key)
+        if response is not None:
+            return response_model.model_validate(response)
+        if self.inner is None or self.mode == self.REPLAY:
+            raise CassetteMiss(f"No recorded response for {_query_of(messages)!r}")
+        result = await self.inner.create(messages, response_model, **kwargs)
+        self._record(key, response_model, messages, result)
+        return result
+
+    async def stream(
+        self, messages: Messages, **kwargs
+    ) -> AsyncIterator[LlmActionType]:
+        key = self._key(LlmPlan, messages)
+        response = self._responses.get(key)
+        if response is not None:
+            for action in LlmPlan.model_validate(response).actions:
+                yield action
+            return
+        if self.inner is None or self.mode == self.REPLAY:
+            raise CassetteMiss(f"No recorded response for {_query_of(messages)!r}")
+        actions: List[LlmActionType] = []
+        async for action in self.inner.stream(messages, **kwargs):
+            actions.append(action)
+            yield action
+        self._record(key, LlmPlan, messages, LlmPlan(actions=actions))
+
+    def usage(self) -> LlmUsageStats:
+        # Replayed responses cost nothing; recorded ones cost what they did.
+        return self.inner.usage() if self.inner is not None else super().usage()
+
+    def _key(self, response_model: Type[BaseModel], messages: Messages) -> str:
+        stable = [
+            {
+                "role": message["role"],
+                "content": "\n".join(
+                    line
+                    for line in message["content"].splitlines()
+                    if not line.startswith("**Current time:**")
+                ),
+            }
+            for message in messages
+        ]
+        payload = json.dumps([response_model.__name__, stable], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _record(
+        self,
+        key: str,
+        response_model: Type[BaseModel],
+        messages: Messages,
+        result: BaseModel,
+    ) -> None:
+        response = result.model_dump(mode="json")
+        record = {
+            "key": key,
+            "model": response_model.__name__,
+            # For whoever reads the file; matching only uses the key.
+            "query": _query_of(messages),
+            "response": response,
+        }
+        with self._lock:
+            self._responses[key] = response
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+class SyntheticLlmError(Exception):
+    """A failure injected by the synthetic backend."""
+
+
+class SyntheticBackend(LlmBackend):
+    """
+    Answers without an LLM, for load testing: reads the sodas, the customer
+    and the requests back out of the prompt context and plans a purchase for
+    each soda a query names, a history lookup when it mentions history, and
+    a greeting otherwise. Each call takes a log-normal latency around
+    ``latency_ms`` and fails with probability ``error_rate``.
+    """
+
+    name = "synthetic"
+
+    def __init__(
+        self,
+        latency_ms: float,
+        latency_sigma: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        super().__init__()
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    async def create(
+        self, messages: Messages, response_model: Type[BaseModel], **kwargs
+    ) -> Any:
+        latency, fails = self._draw()
+        await asyncio.sleep(latency)
+        if fails:
+            raise SyntheticLlmError("Synthetic LLM failure")
+        return self._answer(messages, response_model)
+
+    async def stream(
+        self, messages: Messages, **kwargs
+    ) -> AsyncIterator[LlmActionType]:
+        latency, fails = self._draw()
+        if fails:
+            await asyncio.sleep(latency)
+            raise SyntheticLlmError("Synthetic LLM failure")
+        actions = self._answer(messages, LlmPlan).actions
+        # The latency is spread over the actions, as if generated one by one.
+        for action in actions:
+            await asyncio.sleep(latency / len(actions))
+            yield action
+
+    def _answer(self, messages: Messages, response_model: Type[BaseModel]) -> Any:
+        result = self._plan_for(messages, response_model)
+        # Estimated like the prompt context budget; there is no tokenizer.
+        self._record_usage(
+            estimate_tokens("".join(message["content"] for message in messages)),
+            estimate_tokens(result.model_dump_json()),
+        )
+        return result
+
+    def _plan_for(self, messages: Messages, response_model: Type[BaseModel]) -> Any:
+        context = "\n".join(message["content"] for message in messages[1:])
+        sodas = [row[1] for row in _table(context, SODA_HEADER, 4)]
+        if response_model is LlmBatchPlan:
+            return LlmBatchPlan(
+                plans=[
+                    LlmBatchItem(
+                        query_id=query_id,
+                        actions=self._plan(json.loads(query), sodas, []),
+                    )
+                    for query_id, query in _table(context, REQUESTS_HEADER, 2)
+                ]
+            )
+        customers = _table(context, CUSTOMER_HEADER, 2)
+        customer = customers[0] if customers else []
+        return LlmPlan(actions=self._plan(_query_of(messages), sodas, customer))
+
+    def _draw(self) -> Tuple[float, bool]:
+        median = self.latency_ms / 1000
+        if median <= 0:
+            latency = 0.0
+        elif self.latency_sigma > 0:
+            latency = self._random.lognormvariate(math.log(median), self.latency_sigma)
+        else:
+            latency = median
+        return latency, self._random.random() < self.error_rate
+
+    def _plan(
+        self, query: str, sodas: List[str], customer: List[str]
+    ) -> List[LlmActionType]:
+        text = query.lower()
+        actions: List[LlmActionType] = []
+        for soda in sodas:
+            name = soda.lower()
+            if name in text:
+                # "3 cola", "2 cans of cola"
+                quantity = re.search(rf"\b(\d+) (?:\w+ ){{0,2}}{re.escape(name)}", text)
+                actions.append(
+                    LlmPurchaseAction(
+                        intent="purchase",
+                        soda_name=soda,
+                        quantity=max(1, int(quantity.group(1))) if quantity else 1,
+                    )
+                )
+        if "history" in text or "bought" in text:
+            actions.append(
+                LlmTransactionHistoryAction(
+                    intent="check_transactions_history",
+                    customer=LlmCustomer(
+                        id=int(customer[0]) if customer else None,
+                        name=customer[1] if customer else None,
+                    ),
+                )
+            )
+        if not actions:
+            actions.append(
+                LlmGeneralAction(intent="greeting", message="Hi! What can I get you?")
+            )
+        return actions
+
+
+def _query_of(messages: Messages) -> str:
+    return messages[-1]["content"] if messages else ""
+
+
+def _table(text: str, header: str, columns: int) -> List[List[str]]:
+    """The ``|``-separated rows following ``header`` in a prompt context."""
+    lines = text.splitlines()
+    if header not in lines:
+        return []
+    rows = []
+    for line in lines[lines.index(header) + 1 :]:
+        cells = [cell.strip() for cell in line.split(" | ", columns - 1)]
+        if line.startswith("**") or len(cells) != columns:
+            break
+        rows.append(cells)
+    return rows
+
+
+def create_llm_backend(settings: Settings = CONFIG) -> LlmBackend:
+    backend = settings.llm_backend
+    if backend == "gemini":
+        return GeminiBackend(api_key=settings.gemini_api_key)
+    if backend == "synthetic":
+        return SyntheticBackend(
+            latency_ms=settings.llm_sim_latency_ms,
+            latency_sigma=settings.llm_sim_latency_sigma,
+            error_rate=settings.llm_sim_error_rate,
+            seed=settings.llm_sim_seed,
+        )
+    if backend == CassetteBackend.RECORD:
+        return CassetteBackend(
+            settings.llm_cassette_path,
+            CassetteBackend.RECORD,
+            inner=GeminiBackend(api_key=settings.gemini_api_key),
+        )
+    if backend == CassetteBackend.REPLAY:
+        return CassetteBackend(settings.llm_cassette_path, CassetteBackend.REPLAY)
+    raise ValueError(f"Unknown LLM backend: {backend}")
@@ -0,0 +1,314 @@
+import asyncio
+import copy
+import random
+import threading
+import time
+from collections import deque
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Set,
+)
+
+from pydantic import BaseModel
+
+from utils.deadline import Deadline, DeadlineExceeded
+from utils.timing import Histogram, HistogramStats
+
+LLM_LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 15000, 30000)
+
+
+class LlmUnavailable(Exception):
+    """The circuit breaker is open; the LLM is not being called."""
+
+
+class CircuitBreaker:
+    """
+    Opens when at least ``failure_rate`` of the last ``window`` calls failed
+    (once ``min_calls`` have been seen), rejects calls for
+    ``cooldown_seconds``, then lets a single probe through: its outcome
+    closes the breaker or opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        window: int,
+        min_calls: int,
+        failure_rate: float,
+        cooldown_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown_seconds = cooldown_seconds
+        self._clock = clock
+        self._outcomes: Deque[bool] = deque(maxlen=max(1, window))
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at < self.cooldown_seconds:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                if self._probing:
+                    self._probing = False
+                    if success:
+                        self._opened_at = None
+                        self._outcomes.clear()
+                    else:
+                        self._open()
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (
+                len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.failure_rate
+            ):
+                self._open()
+
+    def abandon(self) -> None:
+        """The call last allowed was cancelled; let another probe through."""
+        with self._lock:
+            self._probing = False
+
+    def _open(self) -> None:
+        self._opened_at = self._clock()
+        self.times_opened += 1
+
+
+class LlmCallStats(BaseModel):
+    calls: int = 0
+    successes: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    retries: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    # Calls refused while the breaker was open
+    rejected: int = 0
+    breaker_state: str = CircuitBreaker.CLOSED
+    breaker_opened: int = 0
+    p95_ms: Optional[float] = None
+    # Successful attempts
+    latency_ms: Optional[HistogramStats] = None
+
+
+class LlmCallManager:
+    """
+    Runs LLM requests within a caller's Deadline. Failed attempts are retried
+    with jittered exponential backoff only while the remaining budget allows;
+    an attempt still running after the recent p95 latency may get a hedged
+    twin, first success wins; a CircuitBreaker fails calls fast while the
+    LLM keeps erroring.
+
+    ``create`` is the client call, e.g. ``client.messages.create``, and
+    ``create_iterable`` its streaming counterpart.
+    """
+
+    def __init__(
+        self,
+        create: Callable[..., Awaitable[Any]],
+        breaker: CircuitBreaker,
+        create_iterable: Optional[Callable[..., AsyncIterator[Any]]] = None,
+        max_attempts: int = 3,
+        backoff_seconds: float = 0.5,
+        hedge_enabled: bool = False,
+        hedge_min_samples: int = 20,
+        latency_window: int = 200,
+    ):
+        self.create = create
+        self.create_iterable = create_iterable
+        self.breaker = breaker
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_seconds = backoff_seconds
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies: Deque[float] = deque(maxlen=latency_window)
+        self._latency_histogram = Histogram(LLM_LATENCY_BUCKETS_MS)
+        self._stats = LlmCallStats()
+        self._lock = threading.Lock()
+
+    async def call(self, deadline: Deadline, messages: List[Dict], **kwargs) -> Any:
+        self._count("calls")
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise LlmUnavailable("The assistant is temporarily unavailable")
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                self._count("timeouts")
+                raise DeadlineExceeded("Timed out planning the request")
+            try:
+                result = await asyncio.wait_for(
+                    self._attempt(messages, kwargs), timeout=remaining
+                )
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            except asyncio.TimeoutError:
+                self.breaker.record(False)
+                self._count("timeouts")
+                raise DeadlineExceeded("Timed out planning the request")
+            except Exception:
+                self.breaker.record(False)
+                self._count("failures")
+                attempt += 1
+                delay = self._backoff(attempt)
+                if attempt >= self.max_attempts or delay >= deadline.remaining():
+                    raise
+                await asyncio.sleep(delay)
+                self._count("retries")
+                continue
+            self.breaker.record(True)
+            self._count("successes")
+            return result
+
+    async def stream(
+        self, deadline: Deadline, messages: List[Dict], **kwargs
+    ) -> AsyncIterator[Any]:
+        """
+        Yield the items of a streamed response as they are parsed. Once output
+        may have reached the caller nothing is retried nor hedged; only the
+        deadline and the breaker apply.
+        """
+        if self.create_iterable is None:
+            raise LlmUnavailable("Streaming is not supported by this client")
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise LlmUnavailable("The assistant is temporarily unavailable")
+        items = self.create_iterable(
+            messages=copy.deepcopy(messages), **kwargs
+        ).__aiter__()
+        try:
+            while True:
+                remaining = deadline.remaining()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    item = await asyncio.wait_for(items.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+                yield item
+        except (asyncio.CancelledError, GeneratorExit):
+            self.breaker.abandon()
+            raise
+        except asyncio.TimeoutError:
+            self.breaker.record(False)
+            self._count("timeouts")
+            raise DeadlineExceeded("Timed out planning the request")
+        except Exception:
+            self.breaker.record(False)
+            self._count("failures")
+            raise
+        finally:
+            aclose = getattr(items, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        self.breaker.record(True)
+        self._count("successes")
+
+    def stats(self) -> LlmCallStats:
+        with self._lock:
+            stats = self._stats.model_copy()
+        stats.breaker_state = self.breaker.state
+        stats.breaker_opened = self.breaker.times_opened
+        p95 = self._p95()
+        stats.p95_ms = p95 * 1000 if p95 is not None else None
+        stats.latency_ms = self._latency_histogram.stats()
+        return stats
+
+    def _backoff(self, attempt: int) -> float:
+        return self.backoff_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.0)
+
+    def _p95(self) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def _hedge_after(self) -> Optional[float]:
+        if not self.hedge_enabled or len(self._latencies) < self.hedge_min_samples:
+            return None
+        return self._p95()
+
+    async def _attempt(self, messages: List[Dict], kwargs: Dict[str, Any]) -> Any:
+        tasks: Set["asyncio.Task[Any]"] = set()
+        try:
+            first = asyncio.ensure_future(self._timed(messages, kwargs))
+            tasks.add(first)
+            hedge_after = self._hedge_after()
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if done:
+                return first.result()
+
+            self._count("hedges")
+            second = asyncio.ensure_future(self._timed(messages, kwargs))
+            tasks.add(second)
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            assert error is not None
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _timed(self, messages: List[Dict], kwargs: Dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        # The client edits messages in place (instructor appends the schema to
+        # the system message), so every request gets its own copy.
+        result = await self.create(messages=copy.deepcopy(messages), **kwargs)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._latencies.append(elapsed)
+        self._latency_histogram.observe(elapsed * 1000)
+        return result
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self._stats, name, getattr(self._stats, name) + 1)
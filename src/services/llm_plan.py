@@ -0,0 +1,221 @@
+from datetime import datetime
+from typing import Any, Dict, List, Literal, Optional, Union
+
+from instructor import OpenAISchema
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+from typing_extensions import Annotated
+
+from domain.models.action import (
+    GeneralAction,
+    InventoryManagementAction,
+    InventoryOperation,
+    PurchaseAction,
+    TransactionHistoryAction,
+    UserActions,
+    UserIntent,
+)
+from domain.models.customer import CustomerBase
+from domain.models.soda import Soda
+
+# What the LLM fills in. These are deliberately not the domain models: the
+# schema is sent with every request, so it carries only the fields the model
+# has to produce, with one-line descriptions, and titles matching the action
+# names used in the prompt examples. Field names follow the domain models so
+# the examples read the same.
+#
+# Class docstrings end up in the schema, so there are none below.
+
+
+class LlmPurchaseAction(BaseModel):
+    model_config = ConfigDict(title="PurchaseAction")
+
+    intent: Literal["purchase"]
+    soda_name: str = Field(description="Soda name as listed in the inventory")
+    quantity: int = Field(default=1, ge=1)
+
+
+class LlmSoda(BaseModel):
+    model_config = ConfigDict(title="Soda")
+
+    id: Optional[int] = Field(default=None, description="Only for existing sodas")
+    name: str
+    price: Optional[float] = Field(default=None, gt=0)
+    quantity: Optional[int] = Field(
+        default=None, description="Stock level; required for 'add'"
+    )
+
+
+class LlmInventoryManagementAction(BaseModel):
+    model_config = ConfigDict(title="InventoryManagementAction")
+
+    intent: Literal["manage_inventory"]
+    operation: InventoryOperation = Field(
+        description="'update' or 'remove' need the soda id; a new name is 'add'"
+    )
+    soda: LlmSoda
+
+
+class LlmCustomer(BaseModel):
+    model_config = ConfigDict(title="Customer")
+
+    id: Optional[int] = None
+    name: Optional[str] = None
+
+
+class LlmTransactionHistoryAction(BaseModel):
+    model_config = ConfigDict(title="TransactionHistoryAction")
+
+    intent: Literal["check_transactions_history"]
+    customer: LlmCustomer
+    since: Optional[datetime] = Field(
+        default=None, description="Window start, from relative dates; else null"
+    )
+    until: Optional[datetime] = Field(
+        default=None, description="Window end (exclusive); null means now"
+    )
+
+
+class LlmGeneralAction(BaseModel):
+    model_config = ConfigDict(title="GeneralAction")
+
+    intent: Literal["greeting", "unsupported"]
+    message: str = Field(description="Your reply to the user")
+
+
+# A single action; what instructor streams one at a time.
+LlmActionType = Union[
+    LlmPurchaseAction,
+    LlmInventoryManagementAction,
+    LlmTransactionHistoryAction,
+    LlmGeneralAction,
+]
+LlmAction = Annotated[LlmActionType, Field(discriminator="intent")]
+
+
+_SCHEMAS: Dict[type, Dict[str, Any]] = {}
+
+
+class _PrecompiledSchema(OpenAISchema):
+    # Subclassing OpenAISchema keeps instructor from deriving a new model class
+    # from the response model on every call.
+
+    @classmethod
+    def model_json_schema(cls, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        # instructor renders this into the system prompt on every call; the
+        # result is shared and must be treated as read-only.
+        if args or kwargs:
+            return super().model_json_schema(*args, **kwargs)
+        schema = _SCHEMAS.get(cls)
+        if schema is None:
+            schema = _SCHEMAS[cls] = _slim(super().model_json_schema())
+        return schema
+
+
+class LlmPlan(_PrecompiledSchema):
+    model_config = ConfigDict(title="UserActions")
+
+    actions: List[LlmAction] = Field(description="One per thing the user asked")
+
+    def to_user_actions(self, customer: CustomerBase) -> UserActions:
+        return UserActions(
+            actions=[to_domain_action(action, customer) for action in self.actions]
+        )
+
+
+def to_domain_action(action: LlmActionType, customer: CustomerBase):
+    if isinstance(action, LlmPurchaseAction):
+        return PurchaseAction(soda_name=action.soda_name, quantity=action.quantity)
+    if isinstance(action, LlmInventoryManagementAction):
+        return InventoryManagementAction(
+            operation=action.operation,
+            soda=Soda(
+                id=action.soda.id,
+                name=action.soda.name,
+                price=action.soda.price or 0,
+                quantity=action.soda.quantity,
+            ),
+        )
+    if isinstance(action, LlmTransactionHistoryAction):
+        # A customer only ever sees their own history: whatever customer the
+        # LLM put in the action (made up, another caller's, null) is ignored.
+        return TransactionHistoryAction(
+            customer=CustomerBase(
+                id=customer.id, name=customer.name, email=customer.email
+            ),
+            since=action.since,
+            until=action.until,
+        )
+    return GeneralAction(intent=UserIntent(action.intent), message=action.message)
+
+
+_ACTION_ADAPTER: TypeAdapter[LlmActionType] = TypeAdapter(LlmAction)
+
+
+class ActionStreamParser:
+    """
+    Picks the actions out of a streamed LlmPlan document, each as soon as
+    its closing brace arrives: ``feed`` the text chunks as they come.
+    """
+
+    def __init__(self) -> None:
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> List[LlmActionType]:
+        actions: List[LlmActionType] = []
+        for char in chunk:
+            # Objects directly inside the "actions" array sit at depth 2.
+            if self._depth >= 2:
+                self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 3 and char == "{":
+                    self._buffer = [char]
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 2 and char == "}":
+                    actions.append(_ACTION_ADAPTER.validate_json("".join(self._buffer)))
+                    self._buffer = []
+        return actions
+
+
+def _slim(schema: Any) -> Any:
+    """Drop what the LLM doesn't need: generated property titles and the
+    discriminator mapping (``oneOf`` with const intents already says it)."""
+    if isinstance(schema, list):
+        return [_slim(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    slim = {k: _slim(v) for k, v in schema.items() if k != "discriminator"}
+    for prop in slim.get("properties", {}).values():
+        prop.pop("title", None)
+    return slim
+
+
+class LlmBatchItem(BaseModel):
+    model_config = ConfigDict(title="BatchItem")
+
+    query_id: str
+    actions: List[LlmAction] = Field(description="One per thing that user asked")
+
+
+class LlmBatchPlan(_PrecompiledSchema):
+    model_config = ConfigDict(title="BatchActions")
+
+    plans: List[LlmBatchItem] = Field(description="One per query_id")
+
+
+# Built at import rather than on the first request.
+LlmPlan.model_json_schema()
+LlmBatchPlan.model_json_schema()
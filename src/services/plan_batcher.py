@@ -0,0 +1,137 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from pydantic import BaseModel
+
+from domain.models.action import UserActions
+from domain.models.customer import CustomerBase
+from services.soda import InventorySnapshot
+from utils.deadline import Deadline
+from utils.timing import Histogram, HistogramStats
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+BATCH_LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+@dataclass
+class PlanRequest:
+    inventory: InventorySnapshot
+    customer: CustomerBase
+    task_description: str
+    deadline: Deadline
+    query_id: str = ""
+    future: "asyncio.Future[UserActions]" = field(init=False, repr=False)
+
+
+class PlanBatcherStats(BaseModel):
+    batches: int = 0
+    batched_queries: int = 0
+    # Batches that failed and were retried as one call per query
+    fallbacks: int = 0
+    batch_size: HistogramStats
+    latency_ms: HistogramStats
+
+
+class PlanBatcher:
+    """
+    Collects planning requests for up to ``window_seconds`` (or until
+    ``max_size`` are waiting) and plans them with one ``plan_batch`` call,
+    which returns actions per query_id. Requests are only batched with others
+    seeing the same inventory version. A lone request, a failed batch and any
+    query the batch left out go through ``plan_one`` instead.
+    """
+
+    def __init__(
+        self,
+        plan_batch: Callable[
+            [Sequence[PlanRequest], Deadline], Awaitable[Dict[str, UserActions]]
+        ],
+        plan_one: Callable[[PlanRequest], Awaitable[UserActions]],
+        window_seconds: float,
+        max_size: int,
+    ):
+        self.plan_batch = plan_batch
+        self.plan_one = plan_one
+        self.window_seconds = window_seconds
+        self.max_size = max(1, max_size)
+        self._pending: Dict[int, List[PlanRequest]] = {}
+        self._next_id = 0
+        self._batches = 0
+        self._batched_queries = 0
+        self._fallbacks = 0
+        self._sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self._latencies = Histogram(BATCH_LATENCY_BUCKETS_MS)
+
+    async def submit(self, request: PlanRequest) -> UserActions:
+        loop = asyncio.get_running_loop()
+        request.future = loop.create_future()
+        self._next_id += 1
+        request.query_id = f"q{self._next_id}"
+
+        version = request.inventory.version
+        batch = self._pending.get(version)
+        if batch is None:
+            batch = self._pending[version] = []
+            loop.call_later(self.window_seconds, self._flush, version, batch)
+        batch.append(request)
+        if len(batch) >= self.max_size:
+            self._flush(version, batch)
+        # The batch runs on its own; a caller giving up doesn't cancel it.
+        return await asyncio.shield(request.future)
+
+    def stats(self) -> PlanBatcherStats:
+        return PlanBatcherStats(
+            batches=self._batches,
+            batched_queries=self._batched_queries,
+            fallbacks=self._fallbacks,
+            batch_size=self._sizes.stats(),
+            latency_ms=self._latencies.stats(),
+        )
+
+    def _flush(self, version: int, batch: List[PlanRequest]) -> None:
+        # The timer of a batch flushed early for being full finds it gone.
+        if self._pending.get(version) is batch:
+            del self._pending[version]
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[PlanRequest]) -> None:
+        started = time.perf_counter()
+        self._sizes.observe(len(batch))
+        leftovers: List[PlanRequest] = batch
+        if len(batch) > 1:
+            self._batches += 1
+            self._batched_queries += len(batch)
+            deadline = min(
+                (request.deadline for request in batch),
+                key=lambda deadline: deadline.expires_at,
+            )
+            try:
+                plans = await self.plan_batch(batch, deadline)
+            except Exception:
+                self._fallbacks += 1
+                plans = {}
+            leftovers = []
+            for request in batch:
+                plan = plans.get(request.query_id)
+                if plan is None:
+                    leftovers.append(request)
+                elif not request.future.done():
+                    request.future.set_result(plan)
+        if leftovers:
+            await asyncio.gather(*(self._run_one(request) for request in leftovers))
+        self._latencies.observe((time.perf_counter() - started) * 1000)
+
+    async def _run_one(self, request: PlanRequest) -> None:
+        error: Optional[BaseException] = None
+        try:
+            plan = await self.plan_one(request)
+        except Exception as e:
+            error = e
+        if request.future.done():
+            return
+        if error is not None:
+            request.future.set_exception(error)
+        else:
+            request.future.set_result(plan)
@@ -0,0 +1,199 @@
+import json
+import math
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel, computed_field
+
+from domain.models.customer import CustomerBase
+from services.soda import InventorySnapshot
+
+SODA_HEADER = "**Available Sodas** (id | name | price | stock):"
+CUSTOMER_HEADER = "**Current customer** (id | name):"
+REQUESTS_HEADER = "**Requests** (query_id | request):"
+
+
+def _customer_row(customer: CustomerBase) -> str:
+    return f"{customer.id} | {customer.name}"
+
+
+def estimate_tokens(text: str) -> int:
+    """Budgeting estimate, about four characters per token; not a tokenizer."""
+    return math.ceil(len(text) / 4)
+
+
+class PromptContextStats(BaseModel):
+    requests: int = 0
+    total_tokens: int = 0
+    max_tokens: int = 0
+    # Requests whose catalog did not fit the budget and was cut to the sodas
+    # relevant to the query.
+    truncated: int = 0
+
+    @computed_field  # type: ignore[prop-decorator]
+    @property
+    def mean_tokens(self) -> float:
+        return self.total_tokens / self.requests if self.requests else 0.0
+
+
+@dataclass(frozen=True)
+class PromptContext:
+    text: str
+    tokens: int
+    sodas_shown: int
+    sodas_total: int
+
+
+@dataclass(frozen=True)
+class _RenderedInventory:
+    version: int
+    rows: Tuple[str, ...]
+    row_tokens: Tuple[int, ...]
+    total_tokens: int
+    # soda.id -> its row; ids hold across snapshots of the same version
+    positions: Dict[int, int]
+
+
+class PromptContextBuilder:
+    """
+    Renders the inventory and the customer as compact pipe-separated tables
+    for the LLM, within ``token_budget`` estimated tokens. The inventory rows
+    are rendered once per inventory version. When they don't all fit, the
+    sodas the query mentions go first and the rest fill what is left.
+    """
+
+    def __init__(self, token_budget: int):
+        self.token_budget = token_budget
+        self._rendered: Optional[_RenderedInventory] = None
+        self._stats = PromptContextStats()
+        self._lock = threading.Lock()
+
+    def build(
+        self,
+        inventory: InventorySnapshot,
+        customer: CustomerBase,
+        query: str,
+        now: datetime,
+    ) -> PromptContext:
+        header = "\n".join(
+            [
+                CUSTOMER_HEADER,
+                _customer_row(customer),
+                f"**Current time:** {now.isoformat(timespec='minutes')}",
+                SODA_HEADER,
+            ]
+        )
+        return self._compose(inventory, header, "", query)
+
+    def build_batch(
+        self,
+        inventory: InventorySnapshot,
+        requests: Sequence[Tuple[str, str]],
+        now: datetime,
+    ) -> PromptContext:
+        """
+        One inventory table for several ``(query_id, query)`` requests, listed
+        after it. Only the inventory is cut to the budget. The requests come
+        from different customers, so none of them is named: the model must
+        not be able to act on, or talk about, another caller.
+        """
+        header = "\n".join(
+            [
+                f"**Current time:** {now.isoformat(timespec='minutes')}",
+                SODA_HEADER,
+            ]
+        )
+        footer = "\n".join(
+            [REQUESTS_HEADER]
+            + [f"{query_id} | {json.dumps(query)}" for query_id, query in requests]
+        )
+        queries = " ".join(query for _, query in requests)
+        return self._compose(inventory, header, footer, queries)
+
+    def _compose(
+        self, inventory: InventorySnapshot, header: str, footer: str, query: str
+    ) -> PromptContext:
+        rendered = self._render_inventory(inventory)
+        budget = self.token_budget - estimate_tokens(header) - 1
+        if footer:
+            budget -= estimate_tokens(footer) + 1
+        if rendered.total_tokens <= budget:
+            rows = list(rendered.rows)
+        else:
+            rows = self._select_rows(inventory, rendered, query, budget)
+        lines = [header, *rows]
+        hidden = len(rendered.rows) - len(rows)
+        if hidden:
+            lines.append(f"({hidden} more sodas not shown)")
+        if footer:
+            lines.append(footer)
+        text = "\n".join(lines)
+        context = PromptContext(
+            text=text,
+            tokens=estimate_tokens(text),
+            sodas_shown=len(rows),
+            sodas_total=len(rendered.rows),
+        )
+        self._record(context)
+        return context
+
+    def stats(self) -> PromptContextStats:
+        with self._lock:
+            return self._stats.model_copy()
+
+    def _render_inventory(self, inventory: InventorySnapshot) -> _RenderedInventory:
+        rendered = self._rendered
+        if rendered is not None and rendered.version == inventory.version:
+            return rendered
+        rows = tuple(
+            f"{soda.id} | {soda.name} | {soda.price:.2f} | {soda.quantity}"
+            for soda in inventory.sodas
+        )
+        # Each row also costs its newline.
+        row_tokens = tuple(estimate_tokens(row) + 1 for row in rows)
+        rendered = _RenderedInventory(
+            version=inventory.version,
+            rows=rows,
+            row_tokens=row_tokens,
+            total_tokens=sum(row_tokens),
+            positions={soda.id: i for i, soda in enumerate(inventory.sodas) if soda.id},
+        )
+        self._rendered = rendered
+        return rendered
+
+    def _select_rows(
+        self,
+        inventory: InventorySnapshot,
+        rendered: _RenderedInventory,
+        query: str,
+        budget: int,
+    ) -> List[str]:
+        # Leave room for the "(N more sodas not shown)" note.
+        budget -= estimate_tokens(f"({len(rendered.rows)} more sodas not shown)") + 1
+        relevant = [
+            rendered.positions[match.soda.id]
+            for match in inventory.names.relevant(query)
+            if match.soda.id in rendered.positions
+        ]
+        seen = set(relevant)
+        order = relevant + [i for i in range(len(rendered.rows)) if i not in seen]
+        chosen: List[int] = []
+        for position in order:
+            cost = rendered.row_tokens[position]
+            if cost > budget:
+                if position in seen:
+                    continue
+                break
+            budget -= cost
+            chosen.append(position)
+        return [rendered.rows[position] for position in sorted(chosen)]
+
+    def _record(self, context: PromptContext) -> None:
+        with self._lock:
+            self._stats.requests += 1
+            self._stats.total_tokens += context.tokens
+            self._stats.max_tokens = max(self._stats.max_tokens, context.tokens)
+            if context.sodas_shown < context.sodas_total:
+                self._stats.truncated += 1
@@ -1,31 +1,171 @@
-from typing import Optional, Sequence
+import secrets
+import threading
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Callable, List, Mapping, Optional, Sequence, Tuple
 
-from sqlmodel import Session, col, select
+from sqlmodel import Session, col, select, update
 
 from domain.models.app import AppResponse, ErrorDetail
 from domain.models.customer import CustomerDb
 from domain.models.soda import Soda
 from domain.models.transaction_customer import TransactionCustomer
-from infra.db.sqlite import get_session
+from infra.db.sqlite import UnitOfWork
+from services.soda_name_index import NameMatch, SodaNameIndex, describe_candidates
+from utils.metrics import instrument_service
 
 
+@dataclass(frozen=True)
+class InventorySnapshot:
+    """
+    Catalog as of ``version``. The sodas are detached copies shared by every
+    reader: treat them as read-only and never add them to a session.
+    ``catalog_version`` ignores purchases: it only moves when sodas are
+    added, removed, renamed, repriced or restocked.
+    """
+
+    version: int
+    catalog_version: int
+    sodas: Tuple[Soda, ...]
+    by_id: Mapping[int, Soda] = field(repr=False)
+    names: SodaNameIndex = field(repr=False)
+
+
+# UnitOfWork.info key, set once the unit of work has changed the catalog.
+_INVENTORY_WRITTEN = "inventory_written"
+
+
+def _detached_copy(soda: Soda) -> Soda:
+    return Soda(id=soda.id, name=soda.name, price=soda.price, quantity=soda.quantity)
+
+
+@instrument_service
 class SodaService:
-    def __init__(self, db_session: Session):
-        self.db_session = db_session
+    def __init__(self):
+        self._inventory_version = 0
+        self._catalog_version = 0
+        # Versions restart at 0 with every process; this tells them apart.
+        self._boot_id = secrets.token_hex(8)
+        self._catalog_listeners: List[Callable[[int], None]] = []
+        self._inventory_lock = threading.Lock()
+        self._inventory_snapshot: Optional[InventorySnapshot] = None
+
+    @property
+    def inventory_version(self) -> int:
+        """Increases every time this process changes the soda catalog or stock."""
+        return self._inventory_version
+
+    @property
+    def inventory_etag(self) -> str:
+        """
+        Weak ETag for the catalog as of ``inventory_version``. It includes a
+        per-process nonce, so a tag from before a restart or from another
+        worker never matches.
+        """
+        return f'W/"inventory-{self._boot_id}-{self._inventory_version}"'
+
+    def on_catalog_change(self, listener: Callable[[int], None]) -> None:
+        """
+        Register a callback invoked with the new catalog version after each
+        change other than a purchase.
+        """
+        self._catalog_listeners.append(listener)
+
+    def notify_inventory_changed(
+        self, db_session: Session, stock_only: bool = False
+    ) -> None:
+        """
+        Bump the version and drop the snapshot. Call it after committing any
+        write to the soda table, with ``stock_only`` for purchases; inside a
+        unit of work this waits for the final commit.
+        """
+        changed = self._stock_changed if stock_only else self._catalog_changed
+        unit_of_work = UnitOfWork.of(db_session)
+        if unit_of_work is not None:
+            unit_of_work.info[_INVENTORY_WRITTEN] = True
+            unit_of_work.after_commit(changed)
+            return
+        changed()
+
+    def _stock_changed(self) -> None:
+        with self._inventory_lock:
+            self._inventory_version += 1
+            self._inventory_snapshot = None
+
+    def _catalog_changed(self) -> None:
+        with self._inventory_lock:
+            self._inventory_version += 1
+            self._catalog_version += 1
+            self._inventory_snapshot = None
+            catalog_version = self._catalog_version
+        for listener in self._catalog_listeners:
+            listener(catalog_version)
+
+    def get_inventory_snapshot(self, db_session: Session) -> InventorySnapshot:
+        """
+        Return the in-memory catalog, loading it from the database if a change
+        invalidated it. Raises on database errors.
+        """
+        # Once a unit of work has written to the soda table, only its own
+        # session sees the catalog it works on: read through it and keep the
+        # result to the unit of work.
+        unit_of_work = UnitOfWork.of(db_session)
+        own_writes = (
+            unit_of_work is not None and _INVENTORY_WRITTEN in unit_of_work.info
+        )
+        snapshot = self._inventory_snapshot
+        if snapshot is not None and not own_writes:
+            return snapshot
 
-    def create_soda(self, name: str, price: float, quantity: int) -> AppResponse[Soda]:
+        # Read the versions before the rows so the snapshot never claims newer
+        # data than it holds.
+        with self._inventory_lock:
+            version = self._inventory_version
+            catalog_version = self._catalog_version
+        statement = select(Soda).order_by(col(Soda.id))
+        sodas = tuple(_detached_copy(soda) for soda in db_session.exec(statement).all())
+        snapshot = InventorySnapshot(
+            version=version,
+            catalog_version=catalog_version,
+            sodas=sodas,
+            by_id=MappingProxyType({soda.id: soda for soda in sodas if soda.id}),
+            names=SodaNameIndex(sodas),
+        )
+        if own_writes:
+            return snapshot
+        with self._inventory_lock:
+            # A change committed while we were loading; don't install rows that
+            # may predate it, the next reader will load again.
+            if self._inventory_version == version:
+                self._inventory_snapshot = snapshot
+        return snapshot
+
+    def _get_soda_row(self, db_session: Session, soda_id: int) -> AppResponse[Soda]:
+        """Session-bound soda for the write paths, always read from the DB."""
+        soda = db_session.get(Soda, soda_id)
+        if not soda:
+            return AppResponse(
+                error=ErrorDetail(message="Soda not found", cause="not-found")
+            )
+        return AppResponse(data=soda)
+
+    def create_soda(
+        self, db_session: Session, name: str, price: float, quantity: int
+    ) -> AppResponse[Soda]:
         try:
             soda = Soda(name=name, price=price, quantity=quantity)
-            self.db_session.add(soda)
-            self.db_session.commit()
-            self.db_session.refresh(soda)
+            db_session.add(soda)
+            db_session.commit()
+            db_session.refresh(soda)
+            self.notify_inventory_changed(db_session)
             return AppResponse(data=soda)
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
-    def get_soda_by_id(self, soda_id: int) -> AppResponse[Soda]:
+    def get_soda_by_id(self, db_session: Session, soda_id: int) -> AppResponse[Soda]:
         try:
-            soda = self.db_session.get(Soda, soda_id)
+            soda = self.get_inventory_snapshot(db_session).by_id.get(soda_id)
             if not soda:
                 return AppResponse(
                     error=ErrorDetail(message="Soda not found", cause="not-found")
@@ -34,35 +174,68 @@ class SodaService:
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
-    def get_soda_by_name(self, name: str) -> AppResponse[Soda]:
+    def resolve_soda_name(
+        self, db_session: Session, name: str
+    ) -> AppResponse[NameMatch]:
+        """
+        Resolve a free-form name against the catalog, with a confidence score.
+        Several equally likely sodas are reported as ambiguous, not guessed.
+        """
         try:
-            statement = select(Soda).where(col(Soda.name).ilike(f"%{name}%"))
-            soda = self.db_session.exec(statement).first()
-            if not soda:
+            resolution = self.get_inventory_snapshot(db_session).names.resolve(name)
+            if resolution.match:
+                return AppResponse(data=resolution.match)
+            if resolution.ambiguous:
                 return AppResponse(
-                    error=ErrorDetail(message="Soda not found", cause="not-found")
+                    error=ErrorDetail(
+                        message=f"'{name}' could be any of: "
+                        + describe_candidates(resolution.candidates),
+                        cause="ambiguous",
+                    )
                 )
-            return AppResponse(data=soda)
+            return AppResponse(
+                error=ErrorDetail(message="Soda not found", cause="not-found")
+            )
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
-    def get_all_sodas(self) -> AppResponse[Sequence[Soda]]:
+    def get_soda_by_name(self, db_session: Session, name: str) -> AppResponse[Soda]:
+        match_response = self.resolve_soda_name(db_session, name)
+        if not match_response.data:
+            return AppResponse(error=match_response.error)
+        return AppResponse(data=match_response.data.soda)
+
+    def get_all_sodas(
+        self,
+        db_session: Session,
+        limit: Optional[int] = None,
+        after_id: Optional[int] = None,
+    ) -> AppResponse[Sequence[Soda]]:
         try:
-            statement = select(Soda)
-            sodas = self.db_session.exec(statement).all()
-            return AppResponse(data=sodas)
+            sodas = self.get_inventory_snapshot(db_session).sodas
+            if limit is None and after_id is None:
+                return AppResponse(data=sodas)
+            # The snapshot is in id order, so a keyset page is a slice of it.
+            start = (
+                bisect_right(sodas, after_id, key=lambda soda: soda.id or 0)
+                if after_id is not None
+                else 0
+            )
+            end = start + limit if limit is not None else None
+            return AppResponse(data=sodas[start:end])
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
     def update_soda(
         self,
+        db_session: Session,
         soda_id: int,
         name: Optional[str] = None,
         price: Optional[float] = None,
         quantity: Optional[int] = None,
     ) -> AppResponse[Soda]:
         try:
-            soda_response = self.get_soda_by_id(soda_id)
+            soda_response = self._get_soda_row(db_session, soda_id)
             if soda_response.error:
                 return soda_response
 
@@ -75,28 +248,44 @@ class SodaService:
                 soda.price = price
             if quantity is not None:
                 soda.quantity = quantity
-            self.db_session.add(soda)
-            self.db_session.commit()
-            self.db_session.refresh(soda)
+            db_session.add(soda)
+            db_session.commit()
+            db_session.refresh(soda)
+            self.notify_inventory_changed(db_session)
             return AppResponse(data=soda)
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
-    def delete_soda(self, soda_id: int) -> AppResponse[Soda]:
+    def delete_soda(self, db_session: Session, soda_id: int) -> AppResponse[Soda]:
         try:
-            soda_response = self.get_soda_by_id(soda_id)
+            soda_response = self._get_soda_row(db_session, soda_id)
             if soda_response.error:
                 return soda_response
 
             soda = soda_response.data
-            self.db_session.delete(soda)
-            self.db_session.commit()
+            db_session.delete(soda)
+            db_session.commit()
+            self.notify_inventory_changed(db_session)
             return AppResponse(data=soda)
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
+    def take_stock(self, db_session: Session, soda_id: int, quantity: int) -> bool:
+        """
+        Decrement the stock by ``quantity`` in one conditional UPDATE, without
+        committing. Returns False, leaving the row untouched, when the soda
+        does not exist or has fewer than ``quantity`` units.
+        """
+        statement = (
+            update(Soda)
+            .where(col(Soda.id) == soda_id, col(Soda.quantity) >= quantity)
+            .values(quantity=col(Soda.quantity) - quantity)
+        )
+        result = db_session.exec(statement)  # type: ignore[call-overload]
+        return result.rowcount == 1
+
     def get_all_sodas_by_customer_id(
-        self, customer_id: int
+        self, db_session: Session, customer_id: int
     ) -> AppResponse[Sequence[Soda]]:
         try:
             statement = (
@@ -105,10 +294,10 @@ class SodaService:
                 .join(CustomerDb)
                 .where(CustomerDb.id == customer_id)
             )
-            sodas = self.db_session.exec(statement).all()
+            sodas = db_session.exec(statement).all()
             return AppResponse(data=sodas)
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
 
-soda_service = SodaService(db_session=next(get_session()))
+soda_service = SodaService()
@@ -0,0 +1,220 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+from domain.models.soda import Soda
+
+# Names that refer to the same product. A soda stocked under any of them is
+# also found by the others.
+ALIASES: Tuple[FrozenSet[str], ...] = (
+    frozenset({"coke", "coca cola", "cola"}),
+    frozenset({"diet coke", "coke light", "coca cola light"}),
+    frozenset({"coke zero", "coca cola zero"}),
+    frozenset({"pepsi", "pepsi cola"}),
+    frozenset({"dr pepper", "doctor pepper"}),
+    frozenset({"7up", "7 up", "seven up"}),
+    frozenset({"mountain dew", "mtn dew"}),
+    frozenset({"root beer", "rootbeer"}),
+)
+
+# Below this score a name does not match at all.
+MIN_SCORE = 0.6
+# Candidates scoring within this margin of the best one make a name ambiguous.
+AMBIGUITY_MARGIN = 0.1
+
+_NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+
+
+def _singular(word: str) -> str:
+    if len(word) <= 3 or word.endswith("ss"):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ses", "xes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, punctuation-free, singular: "Coca-Cola's" -> "coca cola"."""
+    words = _NON_ALPHANUMERIC.sub(" ", name.lower().replace("'", "")).split()
+    return " ".join(_singular(word) for word in words)
+
+
+def _trigrams(compact: str) -> FrozenSet[str]:
+    padded = f"  {compact} "
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def _edit_distance(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+class _Key:
+    __slots__ = ("words", "compact", "trigrams")
+
+    def __init__(self, normalized: str):
+        self.words = normalized.split()
+        self.compact = normalized.replace(" ", "")
+        self.trigrams = _trigrams(self.compact)
+
+
+@dataclass(frozen=True)
+class NameMatch:
+    soda: Soda
+    # 1.0 for an exact name or alias, lower for fuzzy matches.
+    score: float
+
+
+@dataclass(frozen=True)
+class NameResolution:
+    """Best match for a name, or every close candidate when it is ambiguous."""
+
+    match: Optional[NameMatch] = None
+    candidates: List[NameMatch] = field(default_factory=list)
+
+    @property
+    def ambiguous(self) -> bool:
+        return self.match is None and len(self.candidates) > 1
+
+
+class SodaNameIndex:
+    """
+    Resolves free-form product names ("cokes", "Coca-Cola", "sprit") to the
+    catalog. Exact names and aliases are a dict lookup; anything else is
+    ranked by trigram overlap, edit distance and word containment.
+    """
+
+    def __init__(self, sodas: Iterable[Soda]):
+        self._exact: Dict[str, List[Soda]] = {}
+        self._keys: List[Tuple[_Key, Soda]] = []
+        self._by_trigram: Dict[str, Set[int]] = {}
+        for soda in sodas:
+            self.add(soda)
+
+    def add(self, soda: Soda) -> None:
+        for spelling in self._spellings(soda.name):
+            compact = spelling.replace(" ", "")
+            for exact in {spelling, compact}:
+                matches = self._exact.setdefault(exact, [])
+                if not any(match is soda for match in matches):
+                    matches.append(soda)
+            key = _Key(spelling)
+            position = len(self._keys)
+            self._keys.append((key, soda))
+            for trigram in key.trigrams:
+                self._by_trigram.setdefault(trigram, set()).add(position)
+
+    def resolve(self, name: str) -> NameResolution:
+        normalized = normalize_name(name)
+        if not normalized:
+            return NameResolution()
+
+        exact = self._exact.get(normalized) or self._exact.get(
+            normalized.replace(" ", "")
+        )
+        if exact:
+            matches = [NameMatch(soda=soda, score=1.0) for soda in exact]
+            if len(matches) == 1:
+                return NameResolution(match=matches[0], candidates=matches)
+            return NameResolution(candidates=matches)
+
+        ranked = self._rank(_Key(normalized))
+        if not ranked or ranked[0].score < MIN_SCORE:
+            return NameResolution()
+        close = [
+            match
+            for match in ranked
+            if match.score >= max(MIN_SCORE, ranked[0].score - AMBIGUITY_MARGIN)
+        ]
+        if len(close) == 1:
+            return NameResolution(match=close[0], candidates=close)
+        return NameResolution(candidates=close)
+
+    def exact(self, name: str) -> Optional[Soda]:
+        """The one soda stocked under ``name`` or an alias of it, if any."""
+        normalized = normalize_name(name)
+        matches = self._exact.get(normalized) or self._exact.get(
+            normalized.replace(" ", "")
+        )
+        return matches[0] if matches and len(matches) == 1 else None
+
+    def relevant(self, text: str, max_words: int = 3) -> List[NameMatch]:
+        """
+        Sodas mentioned anywhere in ``text``, best first: every span of up to
+        ``max_words`` words is matched like a name.
+        """
+        words = normalize_name(text).split()
+        best: Dict[int, NameMatch] = {}
+        for size in range(1, max_words + 1):
+            for start in range(len(words) - size + 1):
+                span = " ".join(words[start : start + size])
+                if len(span) < 3:
+                    continue
+                exact = self._exact.get(span) or self._exact.get(span.replace(" ", ""))
+                if exact:
+                    matches = [NameMatch(soda=soda, score=1.0) for soda in exact]
+                else:
+                    matches = [
+                        match
+                        for match in self._rank(_Key(span))
+                        if match.score >= MIN_SCORE
+                    ]
+                for match in matches:
+                    current = best.get(id(match.soda))
+                    if current is None or match.score > current.score:
+                        best[id(match.soda)] = match
+        return sorted(best.values(), key=lambda match: match.score, reverse=True)
+
+    def _spellings(self, name: str) -> Set[str]:
+        normalized = normalize_name(name)
+        spellings = {normalized}
+        for group in ALIASES:
+            if normalized in group or normalized.replace(" ", "") in group:
+                spellings.update(normalize_name(alias) for alias in group)
+        return spellings
+
+    def _rank(self, query: _Key) -> List[NameMatch]:
+        positions: Set[int] = set()
+        for trigram in query.trigrams:
+            positions.update(self._by_trigram.get(trigram, ()))
+
+        best: Dict[int, NameMatch] = {}
+        for position in positions:
+            key, soda = self._keys[position]
+            score = self._score(query, key)
+            current = best.get(id(soda))
+            if current is None or score > current.score:
+                best[id(soda)] = NameMatch(soda=soda, score=score)
+        return sorted(best.values(), key=lambda match: match.score, reverse=True)
+
+    def _score(self, query: _Key, key: _Key) -> float:
+        overlap = len(query.trigrams & key.trigrams) / len(
+            query.trigrams | key.trigrams
+        )
+        longest = max(len(query.compact), len(key.compact))
+        edit = 1 - _edit_distance(query.compact, key.compact) / longest
+        score = max(overlap, edit)
+        # "fanta" for "Fanta Orange": every word given is part of the name.
+        if set(query.words) <= set(key.words):
+            coverage = len(query.compact) / len(key.compact)
+            score = max(score, 0.5 + 0.5 * coverage)
+        return round(score, 3)
+
+
+def describe_candidates(candidates: Sequence[NameMatch]) -> str:
+    return ", ".join(match.soda.name for match in candidates)
@@ -1,66 +1,93 @@
-from typing import Sequence
+from datetime import datetime
+from typing import Iterator, Optional, Sequence
 
-from sqlmodel import Session, select
+from sqlmodel import Session, col, select
 
 from domain.models.app import AppResponse, ErrorDetail
 from domain.models.transaction_customer import TransactionCustomer
-from infra.db.sqlite import get_session
+from infra.db.sqlite import STREAM_BATCH_SIZE, paginate, paginate_keyset
 from services.soda import SodaService, soda_service
 from services.customer import CustomerService, customer_service
+from utils.metrics import instrument_service
 
 
+def _as_local_naive(moment: datetime) -> datetime:
+    """Timestamps are stored as naive local time; compare like with like."""
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone().replace(tzinfo=None)
+
+
+@instrument_service
 class TransactionCustomerService:
     def __init__(
         self,
-        db_session: Session,
         soda_service: SodaService,
         customer_service: CustomerService,
     ):
-        self.db_session = db_session
         self.soda_service = soda_service
         self.customer_service = customer_service
 
     def create_transaction(
-        self, customer_id: int, soda_id: int, quantity: int
+        self, db_session: Session, customer_id: int, soda_id: int, quantity: int
     ) -> AppResponse[TransactionCustomer]:
+        if quantity < 1:
+            return AppResponse(
+                error=ErrorDetail(
+                    message="Quantity must be at least 1", cause="validation"
+                )
+            )
         try:
-            customer_response = self.customer_service.get_customer_by_id(customer_id)
+            customer_response = self.customer_service.get_customer_by_id(
+                db_session, customer_id
+            )
             if not customer_response.data:
                 return AppResponse(error=customer_response.error)
-            soda_response = self.soda_service.get_soda_by_id(soda_id)
-            if soda_response.error:
-                return AppResponse(error=soda_response.error)
-
-            soda = soda_response.data
-            if not soda:
-                return AppResponse(
-                    error=ErrorDetail(message="Soda not found", cause="not-found")
-                )
-            if soda.quantity < quantity:
-                return AppResponse(
-                    error=ErrorDetail(
-                        message="Not enough soda available for purchase",
-                        cause="conflict",
-                    )
-                )
 
-            self.soda_service.update_soda(soda_id, quantity=soda.quantity - quantity)
+            # The stock check and the decrement are one statement, so two
+            # buyers can never both take the last units.
+            if not self.soda_service.take_stock(db_session, soda_id, quantity):
+                db_session.rollback()
+                return self._purchase_failure(db_session, soda_id)
 
             transaction = TransactionCustomer(
                 customer_id=customer_id, soda_id=soda_id, quantity=quantity
             )
-            self.db_session.add(transaction)
-            self.db_session.commit()
-            self.db_session.refresh(transaction)
+            db_session.add(transaction)
+            db_session.commit()
+            self.soda_service.notify_inventory_changed(db_session, stock_only=True)
             return AppResponse(data=transaction)
         except Exception as e:
+            db_session.rollback()
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
+    def _purchase_failure(
+        self, db_session: Session, soda_id: int
+    ) -> AppResponse[TransactionCustomer]:
+        """Tell a missing soda apart from a short one after take_stock refused."""
+        soda_response = self.soda_service.get_soda_by_id(db_session, soda_id)
+        if not soda_response.data:
+            return AppResponse(
+                error=soda_response.error
+                or ErrorDetail(message="Soda not found", cause="not-found")
+            )
+        return AppResponse(
+            error=ErrorDetail(
+                message="Not enough soda available for purchase",
+                cause="conflict",
+            )
+        )
+
     def update_transaction(
-        self, transaction_id: int, customer_id: int, soda_id: int, quantity: int
+        self,
+        db_session: Session,
+        transaction_id: int,
+        customer_id: int,
+        soda_id: int,
+        quantity: int,
     ) -> AppResponse[TransactionCustomer]:
         try:
-            soda_response = self.soda_service.get_soda_by_id(soda_id)
+            soda_response = self.soda_service.get_soda_by_id(db_session, soda_id)
 
             soda = soda_response.data
             if not soda:
@@ -72,9 +99,9 @@ class TransactionCustomerService:
                     )
                 )
 
-            self.soda_service.update_soda(soda_id, quantity=quantity)
+            self.soda_service.update_soda(db_session, soda_id, quantity=quantity)
 
-            transaction = self.db_session.get(TransactionCustomer, transaction_id)
+            transaction = db_session.get(TransactionCustomer, transaction_id)
             if not transaction:
                 return AppResponse(
                     error=ErrorDetail(
@@ -85,18 +112,18 @@ class TransactionCustomerService:
             transaction.customer_id = customer_id
             transaction.soda_id = soda_id
             transaction.quantity = quantity
-            self.db_session.add(transaction)
-            self.db_session.commit()
-            self.db_session.refresh(transaction)
+            db_session.add(transaction)
+            db_session.commit()
+            db_session.refresh(transaction)
             return AppResponse(data=transaction)
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
     def get_transaction_by_id(
-        self, transaction_id: int
+        self, db_session: Session, transaction_id: int
     ) -> AppResponse[TransactionCustomer]:
         try:
-            transaction = self.db_session.get(TransactionCustomer, transaction_id)
+            transaction = db_session.get(TransactionCustomer, transaction_id)
             if not transaction:
                 return AppResponse(
                     error=ErrorDetail(
@@ -107,44 +134,103 @@ class TransactionCustomerService:
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
-    def get_all_transactions(self) -> AppResponse[Sequence[TransactionCustomer]]:
+    def get_all_transactions(
+        self,
+        db_session: Session,
+        limit: Optional[int] = None,
+        after_id: Optional[int] = None,
+    ) -> AppResponse[Sequence[TransactionCustomer]]:
         try:
-            statement = select(TransactionCustomer)
-            transactions = self.db_session.exec(statement).all()
+            statement = paginate(
+                select(TransactionCustomer),
+                col(TransactionCustomer.id),
+                limit=limit,
+                after_id=after_id,
+            )
+            transactions = db_session.exec(statement).all()
             return AppResponse(data=transactions)
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
+    def iter_transactions(self, db_session: Session) -> Iterator[TransactionCustomer]:
+        """Every transaction in id order, fetched in batches from one cursor."""
+        statement = (
+            select(TransactionCustomer)
+            .order_by(col(TransactionCustomer.id))
+            .execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+        yield from db_session.exec(statement)
+
     def get_transactions_by_customer(
-        self, customer_id: int
+        self,
+        db_session: Session,
+        customer_id: int,
+        limit: Optional[int] = None,
+        after_timestamp: Optional[datetime] = None,
+        after_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
     ) -> AppResponse[Sequence[TransactionCustomer]]:
+        """
+        A customer's transactions, optionally within ``[since, until)``, in
+        (timestamp, id) order. That is the order of the (customer_id,
+        timestamp) index, whose entries end in the rowid, so ranges and
+        keyset pages after ``(after_timestamp, after_id)`` are plain index
+        scans.
+        """
+        if (after_timestamp is None) != (after_id is None):
+            return AppResponse(
+                error=ErrorDetail(
+                    message="after_timestamp and after_id go together",
+                    cause="validation",
+                )
+            )
         try:
             statement = select(TransactionCustomer).where(
                 TransactionCustomer.customer_id == customer_id
             )
-            transactions = self.db_session.exec(statement).all()
+            if since is not None:
+                statement = statement.where(
+                    col(TransactionCustomer.timestamp) >= _as_local_naive(since)
+                )
+            if until is not None:
+                statement = statement.where(
+                    col(TransactionCustomer.timestamp) < _as_local_naive(until)
+                )
+            statement = paginate_keyset(
+                statement,
+                (col(TransactionCustomer.timestamp), col(TransactionCustomer.id)),
+                limit=limit,
+                after=(
+                    (_as_local_naive(after_timestamp), after_id)
+                    if after_timestamp is not None
+                    else None
+                ),
+            )
+            transactions = db_session.exec(statement).all()
             return AppResponse(data=transactions or [])
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
-    def delete_transaction(self, transaction_id: int) -> AppResponse[bool]:
+    def delete_transaction(
+        self, db_session: Session, transaction_id: int
+    ) -> AppResponse[bool]:
         try:
-            transaction = self.db_session.get(TransactionCustomer, transaction_id)
+            transaction = db_session.get(TransactionCustomer, transaction_id)
             if not transaction:
                 return AppResponse(
                     error=ErrorDetail(
                         message="Transaction not found", cause="not-found"
                     )
                 )
-            self.db_session.delete(transaction)
-            self.db_session.commit()
+            db_session.delete(transaction)
+            db_session.commit()
             return AppResponse(data=True)
         except Exception as e:
             return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
 
 
 transaction_service = TransactionCustomerService(
-    db_session=next(get_session()),
     soda_service=soda_service,
     customer_service=customer_service,
 )
@@ -1,10 +1,24 @@
-from typing import Callable, Dict, List, Sequence, Union
-import instructor
-
-import google.generativeai as genai
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+import secrets
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+from fastapi.concurrency import run_in_threadpool
+from instructor.exceptions import InstructorRetryException
 
 # from google import genai
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
+from sqlmodel import Session
 
 from config import CONFIG
 from domain.models.action import (
@@ -20,24 +34,72 @@ from domain.models.app import AppResponse, ErrorDetail
 from domain.models.customer import CustomerBase, CustomerDb
 from domain.models.soda import Soda
 from domain.models.transaction_customer import TransactionCustomer
+from infra.db.sqlite import (
+    UnitOfWork,
+    new_session,
+    supports_concurrent_sessions,
+    unit_of_work,
+)
 from services.customer import CustomerService, customer_service
-from services.soda import SodaService, soda_service
+from services.intent_parser import IntentParser, intent_parser
+from services.llm_backend import create_llm_backend
+from services.llm_client import CircuitBreaker, LlmCallManager, LlmUnavailable
+from services.llm_plan import (
+    LlmBatchPlan,
+    LlmPlan,
+    to_domain_action,
+)
+from services.plan_batcher import PlanBatcher, PlanRequest
+from services.prompt_context import PromptContextBuilder
+from services.soda import InventorySnapshot, SodaService, soda_service
 from services.transaction_customer import (
     TransactionCustomerService,
     transaction_service,
 )
-from utils.prompts import get_system_prompt
-
-genai.configure(api_key=CONFIG.gemini_api_key)  # type: ignore
-client = instructor.from_gemini(
-    client=genai.GenerativeModel(  # type: ignore
-        model_name="models/gemini-2.5-flash",
-        # model_name="models/gemini-2.5-pro",
-    ),
-    mode=instructor.Mode.GEMINI_JSON,
-    use_async=False,
+from utils.cache import TTLCache
+from utils.deadline import Deadline, DeadlineExceeded
+from utils.prompts import (
+    BATCH_INSTRUCTIONS,
+    CORE_INSTRUCTIONS,
+    PROMPT_VERSION,
+    render_examples,
+    select_batch_examples,
+    select_examples,
+)
+from utils.metrics import metrics
+from utils.singleflight import SingleFlight
+from utils.text import normalize_text
+from utils.timing import TimingRecorder
+
+Action = Union[
+    PurchaseAction, InventoryManagementAction, TransactionHistoryAction, GeneralAction
+]
+ActionResponse = Union[
+    AppResponse[Soda],
+    AppResponse[TransactionCustomer],
+    AppResponse[Sequence[TransactionCustomer]],
+    AppResponse[str],
+]
+
+plan_failures = metrics.counter(
+    "plan_failures_total",
+    "Planning requests that failed, by cause; validation means the LLM's "
+    "output didn't fit the schema",
+    ("cause",),
 )
-print("api_key:", CONFIG.gemini_api_key)  # Debugging line to check API key
+
+
+def _failure_cause(error: Exception) -> str:
+    if isinstance(error, (InstructorRetryException, ValidationError)):
+        return "validation"
+    return "unknown"
+
+
+# (normalized query, prompt version, catalog version, customer id or None
+# when the plan does not depend on who asked). Purchases don't move the
+# catalog version: a plan names sodas and quantities, and stock is checked
+# when it runs, so plans outlive the stock levels the prompt showed.
+PlanCacheKey = Tuple[str, str, int, Optional[int]]
 
 
 class UserQueryService:
@@ -46,59 +108,392 @@ class UserQueryService:
         customer_service: CustomerService,
         soda_service: SodaService,
         transaction_customer_service: TransactionCustomerService,
+        intent_parser: IntentParser,
     ):
         self.customer_service = customer_service
         self.soda_service = soda_service
         self.transaction_customer_service = transaction_customer_service
+        self.intent_parser = intent_parser
+        self.plan_cache: TTLCache[PlanCacheKey, UserActions] = TTLCache(
+            max_entries=CONFIG.plan_cache_max_entries,
+            ttl_seconds=CONFIG.plan_cache_ttl_seconds,
+        )
+        # Versioned keys already stop stale hits, clearing just frees the memory.
+        soda_service.on_catalog_change(lambda _version: self.plan_cache.clear())
+        # (customer id, plan id) -> plan previewed through /query, waiting for
+        # the customer to confirm it through /query/actions.
+        self.plan_store: TTLCache[Tuple[int, str], UserActions] = TTLCache(
+            max_entries=CONFIG.plan_store_max_entries,
+            ttl_seconds=CONFIG.plan_store_ttl_seconds,
+        )
+        self.prompt_context = PromptContextBuilder(
+            token_budget=CONFIG.prompt_context_token_budget
+        )
+        self.llm_backend = create_llm_backend()
+        self.llm = LlmCallManager(
+            self.llm_backend.create,
+            create_iterable=self.llm_backend.stream,
+            breaker=CircuitBreaker(
+                window=CONFIG.llm_breaker_window,
+                min_calls=CONFIG.llm_breaker_min_calls,
+                failure_rate=CONFIG.llm_breaker_failure_rate,
+                cooldown_seconds=CONFIG.llm_breaker_cooldown_seconds,
+            ),
+            max_attempts=CONFIG.llm_max_attempts,
+            backoff_seconds=CONFIG.llm_retry_backoff_seconds,
+            hedge_enabled=CONFIG.llm_hedge_enabled,
+            hedge_min_samples=CONFIG.llm_hedge_min_samples,
+        )
+        self.llm_flights: SingleFlight[
+            PlanCacheKey, Tuple[UserActions, Optional[int]]
+        ] = SingleFlight()
+        self.plan_batcher = (
+            PlanBatcher(
+                plan_batch=self._plan_batch,
+                plan_one=self._plan_one,
+                window_seconds=CONFIG.llm_batch_window_ms / 1000,
+                max_size=CONFIG.llm_batch_max_size,
+            )
+            if CONFIG.llm_batch_enabled
+            else None
+        )
+        self.action_timings = TimingRecorder()
+        self._read_executor = ThreadPoolExecutor(
+            max_workers=max(1, CONFIG.action_read_concurrency),
+            thread_name_prefix="plan-read",
+        )
 
-    def get_action_plan(
-        self, customer: CustomerBase, task_description: str
+    def _is_customer_independent(
+        self, customer: CustomerBase, user_actions: UserActions
+    ) -> bool:
+        """
+        Whether a plan can be reused for other customers: it must not look up
+        anybody's history nor address the customer by name.
+        """
+        name = customer.name.lower()
+        for action in user_actions.actions:
+            if isinstance(action, TransactionHistoryAction):
+                return False
+            if isinstance(action, GeneralAction) and name in action.message.lower():
+                return False
+        return True
+
+    def _get_cached_plan(
+        self, query: str, catalog_version: int, customer: CustomerBase
+    ) -> Optional[UserActions]:
+        plan = self.plan_cache.get_first(
+            (query, PROMPT_VERSION, catalog_version, None),
+            (query, PROMPT_VERSION, catalog_version, customer.id),
+        )
+        return plan.model_copy(deep=True) if plan is not None else None
+
+    def _cache_plan(
+        self,
+        query: str,
+        catalog_version: int,
+        customer: CustomerBase,
+        user_actions: UserActions,
+    ) -> None:
+        # "yesterday" means something else tomorrow.
+        if any(
+            isinstance(action, TransactionHistoryAction)
+            and (action.since is not None or action.until is not None)
+            for action in user_actions.actions
+        ):
+            return
+        scope = (
+            None
+            if self._is_customer_independent(customer, user_actions)
+            else customer.id
+        )
+        self.plan_cache.set(
+            (query, PROMPT_VERSION, catalog_version, scope),
+            user_actions.model_copy(deep=True),
+        )
+
+    def store_plan(self, customer_id: int, user_actions: UserActions) -> str:
+        """Keep a previewed plan so it can be executed later without the LLM."""
+        plan_id = secrets.token_urlsafe(16)
+        self.plan_store.set((customer_id, plan_id), user_actions.model_copy(deep=True))
+        return plan_id
+
+    def take_plan(self, customer_id: int, plan_id: str) -> Optional[UserActions]:
+        """
+        Remove and return a stored plan; a plan only runs once, and only for
+        the customer it was made for.
+        """
+        return self.plan_store.pop((customer_id, plan_id))
+
+    def _planning_messages(
+        self,
+        inventory: InventorySnapshot,
+        customer: CustomerBase,
+        task_description: str,
+    ) -> List[Dict[str, str]]:
+        examples = select_examples(task_description, CONFIG.prompt_examples_k)
+        prompt_context = self.prompt_context.build(
+            inventory, customer, task_description, now=datetime.now()
+        )
+        return [
+            {
+                "role": "system",
+                "content": CORE_INSTRUCTIONS,
+            },
+            {"role": "user", "content": render_examples(examples)},
+            {
+                "role": "user",
+                "content": prompt_context.text,
+            },
+            {"role": "user", "content": task_description},
+        ]
+
+    def _fallback_plan(
+        self, inventory: InventorySnapshot, task_description: str
+    ) -> Optional[UserActions]:
+        """What the local parser understands while the LLM is unavailable."""
+        if not inventory.sodas or CONFIG.intent_fast_path_enabled:
+            # The fast path already had its go.
+            return None
+        return self.intent_parser.parse(task_description, inventory.names)
+
+    def _load_inventory(self) -> InventorySnapshot:
+        # Own short-lived session: planning waits on the LLM for seconds and
+        # must not keep a pooled connection checked out meanwhile.
+        with new_session() as session:
+            return self.soda_service.get_inventory_snapshot(session)
+
+    async def get_action_plan(
+        self,
+        customer: CustomerBase,
+        task_description: str,
+        deadline: Optional[Deadline] = None,
     ) -> AppResponse[UserActions]:
+        """
+        Plan the query; needs no session of the caller's, so no database
+        connection is held while the LLM answers.
+        """
+        if deadline is None:
+            deadline = Deadline.after(CONFIG.query_timeout_seconds)
+        query = normalize_text(task_description)
         try:
-            available_products_response = self.soda_service.get_all_sodas()
-            system_prompt = get_system_prompt()
-            action_plans = client.messages.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt,
-                    },
-                    {
-                        "role": "user",
-                        "content": f"""**Available Sodas:**
-                        {str(available_products_response.data)}"""
-                        + f"""**Current customer:**
-                        {str(customer)}""",
-                    },
-                    {"role": "user", "content": task_description},
-                ],
-                response_model=UserActions,
-                max_retries=3,
+            # The snapshot's version matches exactly the sodas the prompt shows.
+            inventory = await run_in_threadpool(self._load_inventory)
+        except Exception as e:
+            return AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
+        catalog_version = inventory.catalog_version
+        cached_plan = self._get_cached_plan(query, catalog_version, customer)
+        if cached_plan is not None:
+            return AppResponse(data=cached_plan)
+
+        try:
+            if CONFIG.intent_fast_path_enabled and inventory.sodas:
+                parsed_plan = self.intent_parser.parse(
+                    task_description, inventory.names
+                )
+                if parsed_plan is not None:
+                    return AppResponse(data=parsed_plan)
+
+            action_plans, shared = await self._coalesced_llm_plan(
+                query, inventory, customer, task_description, deadline
+            )
+        except LlmUnavailable as e:
+            plan_failures.inc("unavailable")
+            parsed_plan = self._fallback_plan(inventory, task_description)
+            if parsed_plan is not None:
+                return AppResponse(data=parsed_plan)
+            return AppResponse(error=ErrorDetail(message=str(e), cause="unavailable"))
+        except (DeadlineExceeded, asyncio.TimeoutError):
+            plan_failures.inc("timeout")
+            return AppResponse(
+                error=ErrorDetail(
+                    message="Timed out planning the request", cause="timeout"
+                )
             )
         except Exception as e:
+            plan_failures.inc(_failure_cause(e))
             return AppResponse(
                 error=ErrorDetail(
                     message=str(e),
                     cause="unknown",
                 )
             )
+        if not shared:
+            self._cache_plan(query, catalog_version, customer, action_plans)
         return AppResponse(data=action_plans)
 
+    async def _llm_plan(
+        self,
+        inventory: InventorySnapshot,
+        customer: CustomerBase,
+        task_description: str,
+        deadline: Deadline,
+    ) -> Tuple[UserActions, Optional[int]]:
+        """The LLM's plan and, unless any customer may use it, whose it is."""
+        request = PlanRequest(inventory, customer, task_description, deadline)
+        if self.plan_batcher is not None:
+            user_actions = await self.plan_batcher.submit(request)
+        else:
+            user_actions = await self._plan_one(request)
+        if self._is_customer_independent(customer, user_actions):
+            return user_actions, None
+        return user_actions, customer.id
+
+    async def _plan_one(self, request: PlanRequest) -> UserActions:
+        llm_plan = await self.llm.call(
+            request.deadline,
+            messages=self._planning_messages(
+                request.inventory, request.customer, request.task_description
+            ),
+            response_model=LlmPlan,
+            # Retries are the call manager's, within the deadline.
+            max_retries=1,
+        )
+        return llm_plan.to_user_actions(request.customer)
+
+    async def _plan_batch(
+        self, requests: Sequence[PlanRequest], deadline: Deadline
+    ) -> Dict[str, UserActions]:
+        """Plan requests seeing the same inventory with one LLM call."""
+        examples = select_batch_examples(
+            [request.task_description for request in requests],
+            CONFIG.prompt_examples_k,
+        )
+        prompt_context = self.prompt_context.build_batch(
+            requests[0].inventory,
+            [(request.query_id, request.task_description) for request in requests],
+            now=datetime.now(),
+        )
+        batch_plan = await self.llm.call(
+            deadline,
+            messages=[
+                {
+                    "role": "system",
+                    "content": CORE_INSTRUCTIONS + BATCH_INSTRUCTIONS,
+                },
+                {"role": "user", "content": render_examples(examples)},
+                {"role": "user", "content": prompt_context.text},
+            ],
+            response_model=LlmBatchPlan,
+            max_retries=1,
+        )
+        by_id = {request.query_id: request for request in requests}
+        return {
+            item.query_id: UserActions(
+                actions=[
+                    to_domain_action(action, by_id[item.query_id].customer)
+                    for action in item.actions
+                ]
+            )
+            for item in batch_plan.plans
+            if item.query_id in by_id
+        }
+
+    async def _coalesced_llm_plan(
+        self,
+        query: str,
+        inventory: InventorySnapshot,
+        customer: CustomerBase,
+        task_description: str,
+        deadline: Deadline,
+    ) -> Tuple[UserActions, bool]:
+        """
+        Identical queries arriving together share one LLM call, keyed like
+        the plan cache. A plan that turns out to be customer-specific is only
+        shared with that customer; others make their own call.
+        """
+
+        def plan_for(customer: CustomerBase):
+            return lambda: self._llm_plan(
+                inventory, customer, task_description, deadline
+            )
+
+        key = (query, PROMPT_VERSION, inventory.catalog_version, None)
+        (user_actions, owner), shared = await self.llm_flights.do(
+            key, plan_for(customer), timeout=deadline.remaining()
+        )
+        if owner is not None and owner != customer.id:
+            key = (query, PROMPT_VERSION, inventory.catalog_version, customer.id)
+            (user_actions, owner), shared = await self.llm_flights.do(
+                key, plan_for(customer), timeout=deadline.remaining()
+            )
+        return user_actions.model_copy(deep=True), shared
+
+    async def stream_action_plan(
+        self,
+        customer: CustomerBase,
+        task_description: str,
+        deadline: Optional[Deadline] = None,
+    ) -> AsyncIterator[AppResponse[Action]]:
+        """
+        Like get_action_plan, but yields each action as soon as the LLM has
+        produced it. An error response ends the stream; the completed plan is
+        cached like get_action_plan's. Holds no database connection while the
+        LLM streams.
+        """
+        if deadline is None:
+            deadline = Deadline.after(CONFIG.query_timeout_seconds)
+        query = normalize_text(task_description)
+        try:
+            inventory = await run_in_threadpool(self._load_inventory)
+        except Exception as e:
+            yield AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
+            return
+        plan = self._get_cached_plan(query, inventory.catalog_version, customer)
+        if plan is None and CONFIG.intent_fast_path_enabled and inventory.sodas:
+            plan = self.intent_parser.parse(task_description, inventory.names)
+        if plan is not None:
+            for action in plan.actions:
+                yield AppResponse(data=action)
+            return
+
+        actions: List[Action] = []
+        try:
+            async for llm_action in self.llm.stream(
+                deadline,
+                messages=self._planning_messages(inventory, customer, task_description),
+            ):
+                action = to_domain_action(llm_action, customer)
+                actions.append(action)
+                yield AppResponse(data=action)
+        except LlmUnavailable as e:
+            plan_failures.inc("unavailable")
+            plan = self._fallback_plan(inventory, task_description)
+            if plan is None:
+                yield AppResponse(
+                    error=ErrorDetail(message=str(e), cause="unavailable")
+                )
+                return
+            for action in plan.actions:
+                yield AppResponse(data=action)
+            return
+        except DeadlineExceeded as e:
+            plan_failures.inc("timeout")
+            yield AppResponse(error=ErrorDetail(message=str(e), cause="timeout"))
+            return
+        except Exception as e:
+            plan_failures.inc(_failure_cause(e))
+            yield AppResponse(error=ErrorDetail(message=str(e), cause="unknown"))
+            return
+        self._cache_plan(
+            query, inventory.catalog_version, customer, UserActions(actions=actions)
+        )
+
     def handle_purchase_action(
-        self, customer_id: int, action: PurchaseAction
+        self, db_session: Session, customer_id: int, action: PurchaseAction
     ) -> AppResponse[TransactionCustomer]:
-        soda_response = self.soda_service.get_soda_by_name(action.soda_name)
+        soda_response = self.soda_service.get_soda_by_name(db_session, action.soda_name)
         if not soda_response.data or not soda_response.data.id:
             return AppResponse(error=soda_response.error)
 
         return self.transaction_customer_service.create_transaction(
+            db_session,
             customer_id=customer_id,
             soda_id=soda_response.data.id,
             quantity=action.quantity,
         )
 
     def handle_manage_inventory_action(
-        self, action: InventoryManagementAction
+        self, db_session: Session, action: InventoryManagementAction
     ) -> AppResponse[Soda]:
         if not action.soda.name:
             return AppResponse(
@@ -110,7 +505,15 @@ class UserQueryService:
 
         # Create new soda if it doesn't exist
         if action.operation == InventoryOperation.ADD:
+            if action.soda.quantity is None:
+                return AppResponse(
+                    error=ErrorDetail(
+                        message="You must know how many units of a new soda to add.",
+                        cause="validation",
+                    )
+                )
             return self.soda_service.create_soda(
+                db_session,
                 name=action.soda.name,
                 price=action.soda.price if action.soda.price else 0,
                 quantity=action.soda.quantity,
@@ -119,9 +522,11 @@ class UserQueryService:
         # Read existing soda
         if action.operation == InventoryOperation.READ:
             if not action.soda.id:
-                soda_response = self.soda_service.get_soda_by_name(action.soda.name)
+                soda_response = self.soda_service.get_soda_by_name(
+                    db_session, action.soda.name
+                )
                 return soda_response
-            soda_response = self.soda_service.get_soda_by_id(action.soda.id)
+            soda_response = self.soda_service.get_soda_by_id(db_session, action.soda.id)
             return soda_response
 
         # Update existing soda
@@ -134,6 +539,7 @@ class UserQueryService:
                     )
                 )
             return self.soda_service.update_soda(
+                db_session,
                 soda_id=action.soda.id,
                 price=action.soda.price if action.soda.price > 0 else None,
                 quantity=action.soda.quantity,
@@ -148,10 +554,10 @@ class UserQueryService:
                 )
             )
 
-        return self.soda_service.delete_soda(action.soda.id)
+        return self.soda_service.delete_soda(db_session, action.soda.id)
 
     def handle_transaction_history_action(
-        self, action: TransactionHistoryAction
+        self, db_session: Session, action: TransactionHistoryAction
     ) -> AppResponse[Sequence[TransactionCustomer]]:
         if not action.customer.id:
             return AppResponse(
@@ -162,7 +568,10 @@ class UserQueryService:
             )
         history_response = (
             self.transaction_customer_service.get_transactions_by_customer(
-                customer_id=action.customer.id
+                db_session,
+                customer_id=action.customer.id,
+                since=action.since,
+                until=action.until,
             )
         )
         if not history_response.data:
@@ -174,37 +583,103 @@ class UserQueryService:
     def handle_general_action(self, action: GeneralAction) -> str:
         return action.message
 
+    def _is_read_action(self, action: Action) -> bool:
+        if isinstance(action, TransactionHistoryAction):
+            return True
+        return (
+            isinstance(action, InventoryManagementAction)
+            and action.operation == InventoryOperation.READ
+        )
+
+    def _timing_name(self, action: Action) -> str:
+        if isinstance(action, InventoryManagementAction):
+            return f"{action.intent.value}.{action.operation.value}"
+        return action.intent.value
+
+    def _execute_action(
+        self, work: UnitOfWork, customer_id: int, action: Action
+    ) -> ActionResponse:
+        with self.action_timings.time(self._timing_name(action)):
+            if isinstance(action, PurchaseAction):
+                return work.run(
+                    partial(
+                        self.handle_purchase_action,
+                        customer_id=customer_id,
+                        action=action,
+                    )
+                )
+            if isinstance(action, InventoryManagementAction):
+                return work.run(
+                    partial(self.handle_manage_inventory_action, action=action)
+                )
+            if isinstance(action, TransactionHistoryAction):
+                return work.run(
+                    partial(self.handle_transaction_history_action, action=action)
+                )
+            return AppResponse(data=self.handle_general_action(action))
+
+    def _execute_read_action(
+        self, action: Union[InventoryManagementAction, TransactionHistoryAction]
+    ) -> ActionResponse:
+        """Run a read on its own session, outside the plan's unit of work."""
+        with (
+            self.action_timings.time(self._timing_name(action)),
+            new_session() as session,
+        ):
+            if isinstance(action, TransactionHistoryAction):
+                return self.handle_transaction_history_action(session, action)
+            return self.handle_manage_inventory_action(session, action)
+
     def execute_actions(
-        self, customer_id: int, user_actions: UserActions
-    ) -> AppResponse[
-        List[
-            AppResponse[Soda]
-            | AppResponse[TransactionCustomer]
-            | AppResponse[Sequence[TransactionCustomer]]
-            | AppResponse[str]
-        ]
-    ]:
+        self,
+        db_session: Session,
+        customer_id: int,
+        user_actions: UserActions,
+        on_result: Optional[Callable[[ActionResponse], None]] = None,
+    ) -> AppResponse[List[ActionResponse]]:
+        """
+        Run the plan as one unit of work. ``on_result`` gets each action's
+        response, in plan order, as soon as it is settled; nothing is
+        committed until the whole plan has run.
+        """
         try:
-            out: List[
-                AppResponse[Soda]
-                | AppResponse[TransactionCustomer]
-                | AppResponse[Sequence[TransactionCustomer]]
-                | AppResponse[str]
-            ] = []
-            for action in user_actions.actions:
-                if isinstance(action, PurchaseAction):
-                    purchase_response = self.handle_purchase_action(customer_id, action)
-                    out.append(purchase_response)
-                elif isinstance(action, InventoryManagementAction):
-                    inventory_response = self.handle_manage_inventory_action(action)
-                    out.append(inventory_response)
-                elif isinstance(action, TransactionHistoryAction):
-                    history_response = self.handle_transaction_history_action(action)
-                    out.append(history_response)
-                else:
-                    general_response = self.handle_general_action(action)
-                    out.append(AppResponse(data=general_response))
-            return AppResponse(data=out)
+            actions = user_actions.actions
+            # Reads ahead of the first write only see committed data either
+            # way, so they run next to each other, and before the unit of work
+            # starts: the plan never holds its connection while waiting on
+            # theirs. Later reads stay in the unit of work to see the writes.
+            concurrent_reads: List[int] = []
+            for index, action in enumerate(actions):
+                if self._is_read_action(action):
+                    concurrent_reads.append(index)
+                elif not isinstance(action, GeneralAction):
+                    break
+            if len(concurrent_reads) < 2 or not supports_concurrent_sessions:
+                concurrent_reads = []
+
+            out: List[Optional[ActionResponse]] = [None] * len(actions)
+            pending_reads = {
+                index: self._read_executor.submit(
+                    self._execute_read_action, actions[index]
+                )
+                for index in concurrent_reads
+            }
+            for index, pending in pending_reads.items():
+                out[index] = pending.result()
+            # One transaction and one commit for the whole plan; each action
+            # runs in its own savepoint so a failed one is undone on its own.
+            with unit_of_work(db_session) as work:
+                for index, action in enumerate(actions):
+                    result = out[index]
+                    if result is None:
+                        result = out[index] = self._execute_action(
+                            work, customer_id, action
+                        )
+                    if on_result is not None:
+                        on_result(result)
+            return AppResponse(
+                data=[response for response in out if response is not None]
+            )
         except Exception as e:
             return AppResponse(
                 error=ErrorDetail(
@@ -218,4 +693,5 @@ user_query_service = UserQueryService(
     customer_service=customer_service,
     soda_service=soda_service,
     transaction_customer_service=transaction_service,
+    intent_parser=intent_parser,
 )
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+from pydantic import BaseModel, computed_field
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    size: int = 0
+    max_entries: int = 0
+
+    @computed_field  # type: ignore[prop-decorator]
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class TTLCache(Generic[K, V]):
+    """
+    Thread-safe LRU cache whose entries also expire ``ttl_seconds`` after
+    they were stored.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: OrderedDict[K, Tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats(max_entries=max_entries)
+
+    def get(self, key: K) -> Optional[V]:
+        return self.get_first(key)
+
+    def get_first(self, *keys: K) -> Optional[V]:
+        """Return the value of the first live key; counts a single hit or miss."""
+        with self._lock:
+            now = self._clock()
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires_at, value = entry
+                if expires_at <= now:
+                    del self._entries[key]
+                    self._stats.expirations += 1
+                    continue
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return value
+            self._stats.misses += 1
+            return None
+
+    def set(self, key: K, value: V) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+
+    def pop(self, key: K) -> Optional[V]:
+        """Remove and return a live value; counts a hit or miss like get."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                self._stats.expirations += 1
+                self._stats.misses += 1
+                return None
+            self._stats.hits += 1
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return self._stats.model_copy(update={"size": len(self._entries)})
+
+    def __len__(self) -> int:
+        return len(self._entries)
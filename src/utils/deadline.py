@@ -0,0 +1,24 @@
+import time
+from dataclasses import dataclass
+
+
+class DeadlineExceeded(Exception):
+    """The time budget for the request ran out."""
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """A point in ``time.monotonic()`` time by which a request must finish."""
+
+    expires_at: float
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
@@ -1,6 +1,14 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from config import CONFIG
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=CONFIG.bcrypt_rounds
+)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -9,3 +17,69 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
+
+
+def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """Verify, and return a fresh hash too if the stored one is outdated."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHasherBusy(Exception):
+    """Too many hashes are already waiting; the caller should retry later."""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a small process pool so hashing never blocks the event
+    loop nor competes with request handling for the GIL. At most
+    ``max_pending`` hashes may be queued or running; beyond that callers get
+    PasswordHasherBusy instead of piling up.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._running: Optional[asyncio.Semaphore] = None
+        self._pending = 0
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify_and_update(
+        self, plain_password: str, hashed_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        return await self._run(
+            verify_and_update_password, plain_password, hashed_password
+        )
+
+    async def _run(self, function, *args):
+        if self._pending >= self.max_pending:
+            raise PasswordHasherBusy("Too many password operations in progress")
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._running = asyncio.Semaphore(self.workers)
+        assert self._running is not None
+        self._pending += 1
+        try:
+            # Only hand the pool as much work as it can run right away, so the
+            # backlog waits here where max_pending can see it.
+            async with self._running:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool, function, *args)
+        finally:
+            self._pending -= 1
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._running = None
+
+
+password_hasher = PasswordHasher(
+    workers=CONFIG.password_hash_workers,
+    max_pending=CONFIG.password_hash_max_pending,
+)
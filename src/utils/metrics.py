@@ -0,0 +1,255 @@
+import functools
+import inspect
+import math
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple, TypeVar
+
+from config import CONFIG
+from utils.timing import Histogram, HistogramStats
+
+# Seconds; from a cached lookup to a slow LLM call.
+LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (label name, value) pairs of one sample
+Labels = Tuple[Tuple[str, str], ...]
+
+
+@dataclass
+class MetricFamily:
+    """One metric in the Prometheus text format: its samples at scrape time."""
+
+    name: str
+    kind: str  # counter, gauge or histogram
+    help: str
+    # (name suffix, labels, value)
+    samples: List[Tuple[str, Labels, float]] = field(default_factory=list)
+
+    def add(self, value: float, **labels: str) -> "MetricFamily":
+        self.samples.append(("", tuple(labels.items()), value))
+        return self
+
+    def add_histogram(
+        self, stats: HistogramStats, scale: float = 1.0, **labels: str
+    ) -> "MetricFamily":
+        """
+        Add a utils.timing Histogram; ``scale`` converts its unit, e.g.
+        0.001 for one kept in milliseconds.
+        """
+        pairs = tuple(labels.items())
+        cumulative = 0
+        for bound, count in stats.buckets.items():
+            cumulative += count
+            le = bound if bound == "+Inf" else f"{float(bound) * scale:g}"
+            self.samples.append(("_bucket", pairs + (("le", le),), cumulative))
+        self.samples.append(("_sum", pairs, stats.sum * scale))
+        self.samples.append(("_count", pairs, stats.count))
+        return self
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples:
+            lines.append(
+                f"{self.name}{suffix}{_render_labels(labels)} {_render_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+def _render_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _render_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Thread-safe counter, one value per combination of label values."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, "counter", self.help)
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            family.add(value, **dict(zip(self.labelnames, labels)))
+        return family
+
+
+class LabeledHistogram:
+    """A utils.timing Histogram per combination of label values."""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        bounds: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.bounds = tuple(bounds)
+        self._children: Dict[Tuple[str, ...], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        child = self._children.get(labels)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labels, Histogram(self.bounds))
+        child.observe(value)
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, "histogram", self.help)
+        with self._lock:
+            children = list(self._children.items())
+        for labels, child in children:
+            family.add_histogram(child.stats(), **dict(zip(self.labelnames, labels)))
+        return family
+
+
+class MetricsRegistry:
+    """
+    Metrics updated as things happen (counters, histograms) plus collectors
+    that read existing stats() only when scraped, so instrumentation already
+    kept elsewhere costs nothing in between.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: List[Counter | LabeledHistogram] = []
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        counter = Counter(name, help, labelnames)
+        self._metrics.append(counter)
+        return counter
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        bounds: Sequence[float] = LATENCY_BUCKETS,
+    ) -> LabeledHistogram:
+        histogram = LabeledHistogram(name, help, labelnames, bounds)
+        self._metrics.append(histogram)
+        return histogram
+
+    def register_collector(
+        self, collector: Callable[[], Iterable[MetricFamily]]
+    ) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        families = [metric.collect() for metric in self._metrics]
+        for collector in self._collectors:
+            families.extend(collector())
+        return "\n".join(family.render() for family in families) + "\n"
+
+
+metrics = MetricsRegistry()
+
+service_call_duration = metrics.histogram(
+    "service_call_duration_seconds",
+    "Duration of service method calls",
+    ("service", "method"),
+)
+
+# The service method running in this context, to which DB queries count.
+_operation: ContextVar[Tuple[str, str]] = ContextVar(
+    "metrics_operation", default=("none", "none")
+)
+
+
+def current_operation() -> Tuple[str, str]:
+    """(service, method) of the innermost instrumented call running."""
+    return _operation.get()
+
+
+C = TypeVar("C", bound=type)
+
+
+def instrument_service(cls: C) -> C:
+    """
+    Time the public methods of a service class and attribute the DB queries
+    they make to them. Generators are left alone: their body runs after the
+    call returns.
+    """
+    if not CONFIG.metrics_enabled:
+        return cls
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.isfunction(method):
+            continue
+        if inspect.isgeneratorfunction(method) or inspect.isasyncgenfunction(method):
+            continue
+        setattr(cls, name, _instrumented(method, (cls.__name__, name)))
+    return cls
+
+
+def _instrumented(method: Callable, operation: Tuple[str, str]) -> Callable:
+    if inspect.iscoroutinefunction(method):
+
+        @functools.wraps(method)
+        async def async_wrapper(*args, **kwargs):
+            token = _operation.set(operation)
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                service_call_duration.observe(time.perf_counter() - started, *operation)
+                _operation.reset(token)
+
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        token = _operation.set(operation)
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            service_call_duration.observe(time.perf_counter() - started, *operation)
+            _operation.reset(token)
+
+    return wrapper
@@ -1,48 +1,222 @@
-from typing import List, Sequence
-from domain.models.customer import CustomerBase
-from domain.models.soda import Soda
-
-
-def get_system_prompt(
-    # customer: CustomerBase, available_sodas: Sequence[Soda]
-) -> str:
-    return """
-    You are an AI assistant embedded in a smart soda vending machine. Your primary function is to understand user requests and translate them into structured JSON commands based on the provided schemas.
-
-        **Your Capabilities:**
-        1.  **Parse Purchase Requests:** Identify the soda name and quantity when a user wants to buy something.
-        2.  **Parse Inventory Management:** Understand when a user is requesting to manage the inventory of a specific soda.
-        3.  **Parse Transaction History Requests:** Recognize when a user wants to see their past or actual purchases.
-        4.  **Handle General Conversation:** Recognize simple greetings or conversational filler.
-        5.  **Identify Unsupported Requests:** If a request is ambiguous, nonsensical, or for a product you don't carry, classify it as unsupported. In unsupported cases, provide a helpful and polite message to the user.
-
-        **Your Rules:**
-        - **Be Precise:** Always map the user's request to the most appropriate action: `PurchaseAction`, `InventoryCheckAction`, or `GeneralAction`.
-        - **Normalize Names:** Convert user input like "cokes", "a coke", or "Coca-Cola" to the standardized `SodaName` enum value, e.g., "coke".
-        - **Default Quantity:** If a user asks to buy a soda without specifying a number (e.g., "I'd like a fanta"), the quantity is `1`.
-        - **Be Decisive:** Do not ask clarifying questions. Choose the most likely action based on the input. If you cannot confidently determine the action or its parameters, use the `GeneralAction` with an `UNSUPPORTED` intent.
-        - **Focus on the Task:** Do not engage in long conversations. Your only goal is to parse the request into a structured command.
-  
-          **Examples matrix:**
-
-        | User Input (Natural Language) | Expected `instructor` Output (Python Object) | Rationale |
-        | :--- | :--- | :--- |
-        | "I want to buy 3 cokes." | `PurchaseAction(intent='purchase', soda_name='coke', quantity=3)` | Clear purchase intent with specified product and quantity. |
-        | "Can I get a sprite please?" | `PurchaseAction(intent='purchase', soda_name='sprite', quantity=1)` | Implied quantity of 1. |
-        | "Two fantas" | `PurchaseAction(intent='purchase', soda_name='fanta', quantity=2)` | Terse but clear purchase intent. |
-        | "How many pepsis do you have?" | `InventoryCheckAction(intent='check_inventory', soda_name='pepsi')` | Specific inventory check. |
-        | "What sodas are available?" | `InventoryCheckAction(intent='check_inventory', soda_name=None)` | General inventory check. |
-        | "Do you have Dr Pepper?" | `InventoryCheckAction(intent='check_inventory', soda_name='dr pepper')` | The LLM should correctly parse multi-word names. |
-        | "Hello there" | `GeneralAction(intent='greeting', message='Hello! :)')` | Simple greeting. |
-        | "Thanks!" | `GeneralAction(intent='greeting', message="Thank you! I'm here to help you.")` | Simple conversational closing. |
-        | "I'm thirsty." | `GeneralAction(intent='unsupported', message="I don't know how to help with that :(")` | Ambiguous request, cannot be mapped to a direct action. |
-        | "Do you have water?" | `GeneralAction(intent='unsupported', message='In this vending machine, we only stock soda products :(')` | Request for an unstocked item. |
-        | "Give me five" | `GeneralAction(intent='unsupported', message='Five what? I am here to help to buy a tasty soda.')` | Highly ambiguous. |
-        | "Add 50 units of Dr Pepper to the stock." | `InventoryManagementAction(intent='manage_inventory', soda=Soda(name='dr pepper', quantity=50))` | Operator: Explicitly adding soda to stock. |
-        | "Set the inventory for fanta to 24 cans." | `InventoryManagementAction(intent='manage_inventory', soda=Soda(name='fanta', quantity=24))` | Operator: Explicitly setting stock. |
-        | "How many pepsis are left?" | `InventoryManagementAction(intent='manage_inventory', soda=Soda(name='pepsi', quantity=None))` | Operator/Customer: Checking stock. The `None` quantity signals a query. |
-        | "What's the stock level for coke?" | `InventoryManagementAction(intent='manage_inventory', soda=Soda(name='coke', quantity=None))` | Operator/Customer: Checking stock. |
-        | "What I have purchased yesterday?" | `TransactionHistoryAction(intent='get_transaction_history', customer=Customer(id=customer.id))` | Request for transaction history. |
-
-
-          Now, analyze the following user request and generate the corresponding Actions, can be more than one action."""
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+# Bump whenever the instructions or the examples change: cached plans and
+# metrics are keyed by it.
+PROMPT_VERSION = "5"
+
+# Sent unchanged on every call so it stays a cacheable prefix; the examples
+# picked for the query follow in their own message.
+CORE_INSTRUCTIONS = """
+You are an AI assistant embedded in a smart soda vending machine. Your primary function is to understand user requests and translate them into structured JSON commands based on the provided schemas.
+
+**Your Capabilities:**
+1.  **Parse Purchase Requests:** Identify the soda name and quantity when a user wants to buy something.
+2.  **Parse Inventory Management:** Understand when a user is requesting to manage the inventory of a specific soda.
+3.  **Parse Transaction History Requests:** Recognize when a user wants to see their past or actual purchases.
+4.  **Handle General Conversation:** Recognize simple greetings or conversational filler.
+5.  **Identify Unsupported Requests:** If a request is ambiguous, nonsensical, or for a product you don't carry, classify it as unsupported. In unsupported cases, provide a helpful and polite message to the user.
+
+**Your Rules:**
+- **Be Precise:** Always map the user's request to the most appropriate action: `PurchaseAction`, `InventoryManagementAction`, `TransactionHistoryAction` or `GeneralAction`.
+- **Normalize Names:** Convert user input like "cokes", "a coke", or "Coca-Cola" to the soda name as listed in the available sodas, e.g., "Coke".
+- **Default Quantity:** If a user asks to buy a soda without specifying a number (e.g., "I'd like a fanta"), the quantity is `1`.
+- **Be Decisive:** Do not ask clarifying questions. Choose the most likely action based on the input. If you cannot confidently determine the action or its parameters, use the `GeneralAction` with an `unsupported` intent.
+- **Focus on the Task:** Do not engage in long conversations. Your only goal is to parse the request into a structured command.
+- **Multiple Requests:** A single message can ask for more than one thing; return one action per request.
+"""
+
+# Added to the system message when several users' requests share one call.
+BATCH_INSTRUCTIONS = """
+**Batched Requests:** You will receive several independent requests, each with its `query_id` and made by a different customer who is not identified. Plan each one on its own as if it were the only request, and return one entry per `query_id`. The examples show the actions for a single request. For transaction history, leave the customer's id and name null: it always means the customer making that request. Do not address customers by name.
+"""
+
+
+@dataclass(frozen=True)
+class PromptExample:
+    query: str
+    output: str
+    rationale: str
+
+
+EXAMPLES: Tuple[PromptExample, ...] = (
+    PromptExample(
+        "I want to buy 3 cokes.",
+        """{"intent": "purchase", "soda_name": "Coke", "quantity": 3}""",
+        "Clear purchase intent with specified product and quantity.",
+    ),
+    PromptExample(
+        "Can I get a sprite please?",
+        """{"intent": "purchase", "soda_name": "Sprite", "quantity": 1}""",
+        "Implied quantity of 1.",
+    ),
+    PromptExample(
+        "Two fantas",
+        """{"intent": "purchase", "soda_name": "Fanta", "quantity": 2}""",
+        "Terse but clear purchase intent.",
+    ),
+    PromptExample(
+        "How many pepsis do you have?",
+        """{"intent": "manage_inventory", "operation": "read", "soda": {"name": "Pepsi"}}""",
+        "Specific inventory check.",
+    ),
+    PromptExample(
+        "Do you have Dr Pepper?",
+        """{"intent": "manage_inventory", "operation": "read", "soda": {"name": "Dr Pepper"}}""",
+        "Multi-word names are kept whole.",
+    ),
+    PromptExample(
+        "Hi, hello there",
+        """{"intent": "greeting", "message": "Hello! :)"}""",
+        "Simple greeting.",
+    ),
+    PromptExample(
+        "Thanks!",
+        """{"intent": "greeting", "message": "Thank you! I'm here to help you."}""",
+        "Simple conversational closing.",
+    ),
+    PromptExample(
+        "I'm thirsty.",
+        """{"intent": "unsupported", "message": "I don't know how to help with that :("}""",
+        "Ambiguous request, cannot be mapped to a direct action.",
+    ),
+    PromptExample(
+        "Do you have water?",
+        """{"intent": "unsupported", "message": "In this vending machine, we only stock soda products :("}""",
+        "Request for an unstocked item.",
+    ),
+    PromptExample(
+        "Give me five",
+        """{"intent": "unsupported", "message": "Five what? I am here to help to buy a tasty soda."}""",
+        "Highly ambiguous.",
+    ),
+    PromptExample(
+        "Add 50 units of Dr Pepper to the stock.",
+        """{"intent": "manage_inventory", "operation": "add", "soda": {"name": "Dr Pepper", "quantity": 50}}""",
+        "Operator: a soda that is not listed yet is added.",
+    ),
+    PromptExample(
+        "Set the inventory for fanta to 24 cans.",
+        """{"intent": "manage_inventory", "operation": "update", "soda": {"id": <fanta id>, "name": "Fanta", "quantity": 24}}""",
+        "Operator: setting stock of a listed soda needs its id.",
+    ),
+    PromptExample(
+        "Remove sprite from the machine.",
+        """{"intent": "manage_inventory", "operation": "remove", "soda": {"id": <sprite id>, "name": "Sprite"}}""",
+        "Operator: removing a listed soda needs its id.",
+    ),
+    PromptExample(
+        "What's the stock level for coke?",
+        """{"intent": "manage_inventory", "operation": "read", "soda": {"name": "Coke"}}""",
+        "Operator/Customer: checking stock.",
+    ),
+    PromptExample(
+        "What have I purchased?",
+        """{"intent": "check_transactions_history", "customer": {"id": <customer id>}}""",
+        "Request for the whole transaction history.",
+    ),
+    PromptExample(
+        "What I have purchased yesterday?",
+        """{"intent": "check_transactions_history", "customer": {"id": <customer id>}, "since": "<yesterday 00:00>", "until": "<today 00:00>"}""",
+        "Time-bounded history: resolve relative dates from the current time.",
+    ),
+)
+
+# Shown when nothing in the query resembles any example.
+DEFAULT_EXAMPLES: Tuple[int, ...] = (0, 3, 5, 14)
+
+_WORD = re.compile(r"[a-z0-9']+")
+_STOP_WORDS = frozenset(
+    {
+        *("a", "an", "the", "and", "to", "of", "for", "is", "are"),
+        *("i", "me", "you", "please", "can", "want", "give"),
+    }
+)
+_NUMBER_WORDS = frozenset(
+    {"one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"}
+)
+
+
+def _terms(text: str) -> List[str]:
+    terms = []
+    for word in _WORD.findall(text.lower()):
+        if word in _STOP_WORDS:
+            continue
+        if word.isdigit() or word in _NUMBER_WORDS:
+            # Quantities matter, not which one.
+            terms.append("<number>")
+            continue
+        # "cokes" and "coke", "purchased" and "purchase" count as the same word.
+        terms.append(word[:6] if len(word) > 6 else word.rstrip("s") or word)
+    return terms
+
+
+class _ExampleIndex:
+    """TF-IDF vectors of the example queries, for cosine similarity."""
+
+    def __init__(self, examples: Sequence[PromptExample]):
+        counts = [Counter(_terms(example.query)) for example in examples]
+        document_frequency = Counter(term for count in counts for term in count)
+        self._idf: Dict[str, float] = {
+            term: math.log((1 + len(examples)) / (1 + df)) + 1
+            for term, df in document_frequency.items()
+        }
+        self._vectors = [self._weigh(count) for count in counts]
+
+    def _weigh(self, count: Counter) -> Dict[str, float]:
+        vector = {
+            term: tf * self._idf[term]
+            for term, tf in count.items()
+            if term in self._idf
+        }
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def rank(self, query: str) -> List[Tuple[float, int]]:
+        vector = self._weigh(Counter(_terms(query)))
+        scores = [
+            (sum(weight * example.get(term, 0.0) for term, weight in vector.items()), i)
+            for i, example in enumerate(self._vectors)
+        ]
+        return sorted(scores, key=lambda score: (-score[0], score[1]))
+
+
+_index = _ExampleIndex(EXAMPLES)
+
+
+def select_examples(query: str, k: int) -> List[PromptExample]:
+    """The ``k`` examples most similar to ``query``, in table order."""
+    if k >= len(EXAMPLES):
+        return list(EXAMPLES)
+    chosen = [i for score, i in _index.rank(query)[:k] if score > 0]
+    for i in DEFAULT_EXAMPLES:
+        if len(chosen) >= k:
+            break
+        if i not in chosen:
+            chosen.append(i)
+    return [EXAMPLES[i] for i in sorted(chosen)]
+
+
+def select_batch_examples(queries: Sequence[str], k: int) -> List[PromptExample]:
+    """Every example chosen for any of the queries, in table order."""
+    chosen = {example for query in queries for example in select_examples(query, k)}
+    return [example for example in EXAMPLES if example in chosen]
+
+
+def render_examples(examples: Sequence[PromptExample]) -> str:
+    rows = "\n".join(
+        f"| {example.query} | `{example.output}` | {example.rationale} |"
+        for example in examples
+    )
+    return (
+        "**Examples:**\n\n"
+        "| User Input | Expected action | Rationale |\n"
+        "| :--- | :--- | :--- |\n"
+        f"{rows}\n\n"
+        "Now, analyze the following user request and generate the corresponding "
+        "actions, can be more than one action."
+    )
+
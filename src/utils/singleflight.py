@@ -0,0 +1,66 @@
+import asyncio
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from pydantic import BaseModel
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class SingleFlightStats(BaseModel):
+    # Calls actually made
+    calls: int = 0
+    # Callers that joined a call already in flight instead
+    coalesced: int = 0
+    in_flight: int = 0
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Concurrent callers with the same key share one in-flight call. The call
+    runs as its own task: a caller giving up (cancelled, or its ``timeout``
+    elapsed) doesn't cancel it for the others. Use from one event loop.
+    """
+
+    def __init__(self) -> None:
+        self._in_flight: Dict[K, "asyncio.Task[V]"] = {}
+        self._stats = SingleFlightStats()
+
+    async def do(
+        self,
+        key: K,
+        call: Callable[[], Awaitable[V]],
+        timeout: Optional[float] = None,
+    ) -> Tuple[V, bool]:
+        """Result of ``call`` for ``key``, and whether it was another caller's."""
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self._stats.calls += 1
+        else:
+            self._stats.coalesced += 1
+        return await asyncio.wait_for(asyncio.shield(task), timeout), shared
+
+    def stats(self) -> SingleFlightStats:
+        stats = self._stats.model_copy()
+        stats.in_flight = len(self._in_flight)
+        return stats
+
+    def _finished(self, key: K, task: "asyncio.Task[V]") -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Retrieved here too, in case every caller gave up on it.
+            task.exception()
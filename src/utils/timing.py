@@ -0,0 +1,80 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Generator, Sequence
+
+from pydantic import BaseModel, computed_field
+
+
+class TimingStats(BaseModel):
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    @computed_field  # type: ignore[prop-decorator]
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+
+class TimingRecorder:
+    """Thread-safe duration aggregates, one set per name."""
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self._clock = clock
+        self._stats: Dict[str, TimingStats] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, name: str) -> Generator[None, None, None]:
+        """Record how long the ``with`` body took, even if it raised."""
+        started = self._clock()
+        try:
+            yield
+        finally:
+            self.record(name, self._clock() - started)
+
+    def record(self, name: str, seconds: float) -> None:
+        milliseconds = seconds * 1000
+        with self._lock:
+            stats = self._stats.setdefault(name, TimingStats())
+            stats.count += 1
+            stats.total_ms += milliseconds
+            stats.max_ms = max(stats.max_ms, milliseconds)
+
+    def stats(self) -> Dict[str, TimingStats]:
+        with self._lock:
+            return {name: stats.model_copy() for name, stats in self._stats.items()}
+
+
+class HistogramStats(BaseModel):
+    # Observations per bucket, keyed by the bucket's inclusive upper bound
+    buckets: Dict[str, int]
+    count: int = 0
+    sum: float = 0.0
+
+
+class Histogram:
+    """Thread-safe fixed-bucket histogram."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = sorted(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def stats(self) -> HistogramStats:
+        labels = [f"{bound:g}" for bound in self.bounds] + ["+Inf"]
+        with self._lock:
+            return HistogramStats(
+                buckets=dict(zip(labels, self._counts)),
+                count=sum(self._counts),
+                sum=self._sum,
+            )
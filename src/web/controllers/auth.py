@@ -3,7 +3,9 @@ from fastapi import APIRouter, HTTPException, Security, status
 from pydantic import BaseModel
 
 from domain.models.auth import AccessToken, TokenData
+from infra.db.sqlite import SessionDep
 from services.auth import auth_service, REFRESH_TOKEN_EXPIRES
+from utils.hash import PasswordHasherBusy
 
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
@@ -17,8 +19,16 @@ class LoginInputDTO(BaseModel):
 @router.post("/login")
 async def login_for_access_token(
     form_data: LoginInputDTO,
+    session: SessionDep,
 ) -> AccessToken:
-    token = auth_service.login(form_data.email, form_data.password)
+    try:
+        token = await auth_service.login(session, form_data.email, form_data.password)
+    except PasswordHasherBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
     if not token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -31,9 +41,10 @@ async def login_for_access_token(
 @router.post("/refresh")
 def refresh(
     token: AccessToken,
+    session: SessionDep,
 ) -> AccessToken:
     """Return a new access token from a refresh token."""
-    customer = auth_service.validate_token(token)
+    customer = auth_service.validate_token(session, token)
     if not customer:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -41,7 +52,8 @@ def refresh(
             headers={"WWW-Authenticate": "Bearer"},
         )
     refresh_token = auth_service.create_access_token(
-        data=TokenData(customer_id=customer.id)
+        data=TokenData(customer_id=customer.id),
+        expires_delta=REFRESH_TOKEN_EXPIRES,
     )
     return AccessToken(
         token=refresh_token,
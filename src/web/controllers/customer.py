@@ -1,11 +1,15 @@
 import json
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 
-from domain.models.app import AppResponse
+from domain.models.app import AppResponse, ErrorDetail
+from infra.db.sqlite import SessionDep, new_session
 from services.customer import customer_service
+from utils.hash import PasswordHasherBusy, password_hasher
+from web.pagination import PageDep, ndjson_response, set_next_cursor
 
 
 router = APIRouter(prefix="/customer", tags=["Customer"])
@@ -24,9 +28,37 @@ class CustomerCreatedResponse(BaseModel):
 @router.post(
     "", responses={status.HTTP_400_BAD_REQUEST: {"model": CustomerCreatedResponse}}
 )
-def create_customer(customer: CustomerCreate):
-    customer_create_response = customer_service.create_customer(
-        name=customer.name, email=customer.email, password=customer.password
+async def create_customer(customer: CustomerCreate, session: SessionDep):
+    # Turn duplicate sign-ups away before spending a hasher slot on them;
+    # create_customer checks again in case another one got in meanwhile.
+    existing_customer_response = await run_in_threadpool(
+        customer_service.get_customer_by_email, session, customer.email
+    )
+    if existing_customer_response.data:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=jsonable_encoder(
+                AppResponse(
+                    error=ErrorDetail(message="Email already exists", cause="conflict")
+                )
+            ),
+        )
+    try:
+        hashed_password = await password_hasher.hash(customer.password)
+    except PasswordHasherBusy as e:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content=jsonable_encoder(
+                AppResponse(error=ErrorDetail(message=str(e), cause="busy"))
+            ),
+            headers={"Retry-After": "1"},
+        )
+    customer_create_response = await run_in_threadpool(
+        customer_service.create_customer,
+        session,
+        name=customer.name,
+        email=customer.email,
+        hashed_password=hashed_password,
     )
     if not customer_create_response.data:
         return JSONResponse(
@@ -39,21 +71,38 @@ def create_customer(customer: CustomerCreate):
 
 
 @router.get("")
-def get_customers():
-    return customer_service.get_all_customers()
+def get_customers(session: SessionDep, page: PageDep, response: Response):
+    customers_response = customer_service.get_all_customers(
+        session, limit=page.limit, after_id=page.after_id
+    )
+    set_next_cursor(response, page, customers_response.data)
+    return customers_response
+
+
+@router.get("/export")
+def export_customers():
+    """Every customer as NDJSON, streamed in constant memory."""
+
+    def rows():
+        # The request session is closed before the body streams; own one.
+        with new_session() as session:
+            yield from customer_service.iter_customers(session)
+
+    return ndjson_response(rows())
 
 
 @router.get("/{customer_id}")
-def get_customer(customer_id: int):
-    customer = customer_service.get_customer_by_id(customer_id)
+def get_customer(customer_id: int, session: SessionDep):
+    customer = customer_service.get_customer_by_id(session, customer_id)
     if not customer.data:
         return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content=customer)
     return customer
 
 
 @router.put("/{customer_id}")
-def update_customer(customer_id: int, customer: CustomerCreate):
+def update_customer(customer_id: int, customer: CustomerCreate, session: SessionDep):
     updated_customer = customer_service.update_customer(
+        session,
         customer_id=customer_id,
         name=customer.name,
         email=customer.email,
@@ -66,8 +115,8 @@ def update_customer(customer_id: int, customer: CustomerCreate):
 
 
 @router.delete("/{customer_id}")
-def delete_customer(customer_id: int):
-    success = customer_service.delete_customer(customer_id)
+def delete_customer(customer_id: int, session: SessionDep):
+    success = customer_service.delete_customer(session, customer_id)
     if not success.data:
         return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content=success)
     return success
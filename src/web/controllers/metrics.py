@@ -0,0 +1,134 @@
+from typing import Iterable, List
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from services.auth import auth_service
+from services.llm_client import CircuitBreaker
+from services.user_query import user_query_service
+from utils.cache import CacheStats
+from utils.metrics import CONTENT_TYPE, MetricFamily, metrics
+
+router = APIRouter(tags=["Metrics"])
+
+
+def _cache_families(caches: Iterable[tuple[str, CacheStats]]) -> List[MetricFamily]:
+    hits = MetricFamily("cache_hits_total", "counter", "Cache lookups that hit")
+    misses = MetricFamily("cache_misses_total", "counter", "Cache lookups that missed")
+    evictions = MetricFamily(
+        "cache_evictions_total", "counter", "Entries evicted to make room"
+    )
+    expirations = MetricFamily(
+        "cache_expirations_total", "counter", "Entries dropped after their TTL"
+    )
+    size = MetricFamily("cache_entries", "gauge", "Entries currently cached")
+    ratio = MetricFamily(
+        "cache_hit_ratio", "gauge", "Hits over lookups since the process started"
+    )
+    for name, stats in caches:
+        hits.add(stats.hits, cache=name)
+        misses.add(stats.misses, cache=name)
+        evictions.add(stats.evictions, cache=name)
+        expirations.add(stats.expirations, cache=name)
+        size.add(stats.size, cache=name)
+        ratio.add(stats.hit_ratio, cache=name)
+    return [hits, misses, evictions, expirations, size, ratio]
+
+
+def _query_pipeline() -> List[MetricFamily]:
+    """The query pipeline's own stats(), read at scrape time."""
+    llm = user_query_service.llm.stats()
+    usage = user_query_service.llm_backend.usage()
+    coalescing = user_query_service.llm_flights.stats()
+    intents = user_query_service.intent_parser.stats()
+    prompt_context = user_query_service.prompt_context.stats()
+    families = [
+        MetricFamily("llm_calls_total", "counter", "Planning calls made").add(
+            llm.calls
+        ),
+        MetricFamily("llm_call_outcomes_total", "counter", "Planning call outcomes")
+        .add(llm.successes, outcome="success")
+        .add(llm.failures, outcome="failure")
+        .add(llm.timeouts, outcome="timeout")
+        .add(llm.rejected, outcome="rejected"),
+        MetricFamily(
+            "llm_retries_total", "counter", "Attempts retried after a failure"
+        ).add(llm.retries),
+        MetricFamily("llm_hedges_total", "counter", "Hedged attempts sent").add(
+            llm.hedges
+        ),
+        MetricFamily(
+            "llm_hedge_wins_total", "counter", "Hedged attempts that answered first"
+        ).add(llm.hedge_wins),
+        MetricFamily(
+            "llm_breaker_open", "gauge", "1 while the circuit breaker rejects calls"
+        ).add(0 if llm.breaker_state == CircuitBreaker.CLOSED else 1),
+        MetricFamily(
+            "llm_breaker_opened_total", "counter", "Times the circuit breaker opened"
+        ).add(llm.breaker_opened),
+        MetricFamily("llm_tokens_total", "counter", "Tokens spent on planning")
+        .add(
+            usage.prompt_tokens,
+            kind="prompt",
+            backend=user_query_service.llm_backend.name,
+        )
+        .add(
+            usage.completion_tokens,
+            kind="completion",
+            backend=user_query_service.llm_backend.name,
+        ),
+        MetricFamily(
+            "llm_coalesced_total",
+            "counter",
+            "Planning requests that joined an identical one in flight",
+        ).add(coalescing.coalesced),
+        MetricFamily(
+            "intent_parser_matches_total",
+            "counter",
+            "Queries planned locally, without the LLM",
+        ).add(intents.matched),
+        MetricFamily(
+            "prompt_context_tokens_total",
+            "counter",
+            "Estimated tokens of inventory/customer context sent",
+        ).add(prompt_context.total_tokens),
+        MetricFamily(
+            "prompt_context_truncated_total",
+            "counter",
+            "Contexts cut to the sodas relevant to the query",
+        ).add(prompt_context.truncated),
+    ]
+    if llm.latency_ms is not None:
+        families.append(
+            MetricFamily(
+                "llm_call_duration_seconds",
+                "histogram",
+                "Duration of successful planning attempts",
+            ).add_histogram(llm.latency_ms, scale=0.001)
+        )
+    if user_query_service.plan_batcher is not None:
+        batching = user_query_service.plan_batcher.stats()
+        families.append(
+            MetricFamily(
+                "llm_batch_size", "histogram", "Queries per planning batch"
+            ).add_histogram(batching.batch_size)
+        )
+    families.extend(
+        _cache_families(
+            [
+                ("plan_cache", user_query_service.plan_cache.stats()),
+                ("plan_store", user_query_service.plan_store.stats()),
+                ("auth_principal", auth_service.principal_cache.stats()),
+            ]
+        )
+    )
+    return families
+
+
+metrics.register_collector(_query_pipeline)
+
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics() -> Response:
+    """Prometheus text exposition of everything in utils.metrics."""
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
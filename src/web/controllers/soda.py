@@ -1,13 +1,15 @@
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Header, HTTPException, Response, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
 from domain.models.app import AppResponse
 from domain.models.soda import Soda
+from infra.db.sqlite import SessionDep
 from services.soda import soda_service
+from web.pagination import PageDep, ndjson_response, set_next_cursor
 
 router = APIRouter(prefix="/soda", tags=["Soda"])
 
@@ -25,23 +27,48 @@ class SodaUpdate(BaseModel):
 
 
 @router.post("")
-def create_soda(soda: SodaCreate):
+def create_soda(soda: SodaCreate, session: SessionDep):
     return soda_service.create_soda(
-        name=soda.name, price=soda.price, quantity=soda.quantity
+        session, name=soda.name, price=soda.price, quantity=soda.quantity
     )
 
 
 @router.get("")
-def get_sodas():
-    return soda_service.get_all_sodas()
+def get_sodas(
+    session: SessionDep,
+    page: PageDep,
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None),
+):
+    # Only this process writes the catalog, so its tag identifies the body.
+    # Read it first: an older tag than the body only costs a refetch.
+    etag = soda_service.inventory_etag
+    sodas_response = soda_service.get_all_sodas(
+        session, limit=page.limit, after_id=page.after_id
+    )
+    if sodas_response.error:
+        return sodas_response
+    if if_none_match == etag:
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+        )
+    response.headers["ETag"] = etag
+    set_next_cursor(response, page, sodas_response.data)
+    return sodas_response
+
+
+@router.get("/export")
+def export_sodas(session: SessionDep):
+    """Every soda as NDJSON, served from the in-memory inventory snapshot."""
+    return ndjson_response(soda_service.get_inventory_snapshot(session).sodas)
 
 
 @router.get(
     "/{soda_id}",
     responses={status.HTTP_404_NOT_FOUND: {"model": AppResponse[Soda]}},
 )
-def get_soda(soda_id: int):
-    soda_response = soda_service.get_soda_by_id(soda_id)
+def get_soda(soda_id: int, session: SessionDep):
+    soda_response = soda_service.get_soda_by_id(session, soda_id)
     if not soda_response.data:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -54,8 +81,9 @@ def get_soda(soda_id: int):
     "/{soda_id}",
     responses={status.HTTP_404_NOT_FOUND: {"model": AppResponse[Soda]}},
 )
-def update_soda(soda_id: int, soda: SodaUpdate):
+def update_soda(soda_id: int, soda: SodaUpdate, session: SessionDep):
     updated_soda_reponse = soda_service.update_soda(
+        session,
         soda_id=soda_id,
         name=soda.name,
         price=soda.price,
@@ -73,8 +101,8 @@ def update_soda(soda_id: int, soda: SodaUpdate):
     "/{soda_id}",
     responses={status.HTTP_404_NOT_FOUND: {"model": AppResponse[bool]}},
 )
-def delete_soda(soda_id: int):
-    success_response = soda_service.delete_soda(soda_id)
+def delete_soda(soda_id: int, session: SessionDep):
+    success_response = soda_service.delete_soda(session, soda_id)
     if not success_response.data:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -84,5 +112,5 @@ def delete_soda(soda_id: int):
 
 
 @router.get("/customer/{customer_id}")
-def get_sodas_by_customer(customer_id: int):
-    return soda_service.get_all_sodas_by_customer_id(customer_id)
+def get_sodas_by_customer(customer_id: int, session: SessionDep):
+    return soda_service.get_all_sodas_by_customer_id(session, customer_id)
@@ -1,10 +1,15 @@
-from fastapi import APIRouter, HTTPException, status
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Response, status
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
 from domain.models.app import AppResponse
 from domain.models.transaction_customer import TransactionCustomer
+from infra.db.sqlite import SessionDep, new_session
 from services.transaction_customer import transaction_service
+from web.pagination import PageDep, ndjson_response, set_next_cursor
 
 router = APIRouter(prefix="/transaction", tags=["TransactionCustomer"])
 
@@ -16,8 +21,9 @@ class TransactionCreate(BaseModel):
 
 
 @router.post("")
-def create_transaction(transaction: TransactionCreate):
+def create_transaction(transaction: TransactionCreate, session: SessionDep):
     new_transaction_response = transaction_service.create_transaction(
+        session,
         customer_id=transaction.customer_id,
         soda_id=transaction.soda_id,
         quantity=transaction.quantity,
@@ -30,8 +36,24 @@ def create_transaction(transaction: TransactionCreate):
 
 
 @router.get("")
-def get_transactions():
-    return transaction_service.get_all_transactions()
+def get_transactions(session: SessionDep, page: PageDep, response: Response):
+    transactions_response = transaction_service.get_all_transactions(
+        session, limit=page.limit, after_id=page.after_id
+    )
+    set_next_cursor(response, page, transactions_response.data)
+    return transactions_response
+
+
+@router.get("/export")
+def export_transactions():
+    """Every transaction as NDJSON, streamed in constant memory."""
+
+    def rows():
+        # The request session is closed before the body streams; own one.
+        with new_session() as session:
+            yield from transaction_service.iter_transactions(session)
+
+    return ndjson_response(rows())
 
 
 @router.get(
@@ -40,8 +62,10 @@ def get_transactions():
         status.HTTP_404_NOT_FOUND: {"model": AppResponse[TransactionCustomer | None]}
     },
 )
-def get_transaction(transaction_id: int):
-    transaction_response = transaction_service.get_transaction_by_id(transaction_id)
+def get_transaction(transaction_id: int, session: SessionDep):
+    transaction_response = transaction_service.get_transaction_by_id(
+        session, transaction_id
+    )
     if not transaction_response.data:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND, content=transaction_response
@@ -54,8 +78,11 @@ def get_transaction(transaction_id: int):
     "/{transaction_id}",
     responses={status.HTTP_404_NOT_FOUND: {"model": AppResponse[TransactionCustomer]}},
 )
-def update_transaction(transaction_id: int, transaction: TransactionCreate):
+def update_transaction(
+    transaction_id: int, transaction: TransactionCreate, session: SessionDep
+):
     updated_transaction_response = transaction_service.update_transaction(
+        session,
         transaction_id=transaction_id,
         customer_id=transaction.customer_id,
         soda_id=transaction.soda_id,
@@ -72,8 +99,8 @@ def update_transaction(transaction_id: int, transaction: TransactionCreate):
     "/{transaction_id}",
     responses={status.HTTP_404_NOT_FOUND: {"model": AppResponse[bool]}},
 )
-def delete_transaction(transaction_id: int):
-    success_response = transaction_service.delete_transaction(transaction_id)
+def delete_transaction(transaction_id: int, session: SessionDep):
+    success_response = transaction_service.delete_transaction(session, transaction_id)
     if not success_response.data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=success_response
@@ -82,5 +109,27 @@ def delete_transaction(transaction_id: int):
 
 
 @router.get("/customer/{customer_id}")
-def get_transactions_by_customer(customer_id: int):
-    return transaction_service.get_transactions_by_customer(customer_id)
+def get_transactions_by_customer(
+    customer_id: int,
+    session: SessionDep,
+    page: PageDep,
+    response: Response,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after_timestamp: Optional[datetime] = None,
+):
+    """
+    Pages in (timestamp, id) order: pass back both the X-Next-After-Timestamp
+    and X-Next-After-Id of the previous page.
+    """
+    transactions_response = transaction_service.get_transactions_by_customer(
+        session,
+        customer_id,
+        limit=page.limit,
+        after_timestamp=after_timestamp,
+        after_id=page.after_id,
+        since=since,
+        until=until,
+    )
+    set_next_cursor(response, page, transactions_response.data, with_timestamp=True)
+    return transactions_response
@@ -1,17 +1,50 @@
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional
+
 from fastapi import APIRouter, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 
+from config import CONFIG
 from domain.models.action import UserActions
-from domain.models.app import AppResponse
-from services.user_query import user_query_service
+from domain.models.app import AppResponse, ErrorDetail
+from domain.models.customer import CustomerBase, CustomerDb
+from infra.db.sqlite import SessionDep, new_session
+from services.user_query import Action, ActionResponse, user_query_service
 from services.customer import customer_service
-
+from services.intent_parser import IntentParserStats
+from services.llm_backend import LlmUsageStats
+from services.llm_client import LlmCallStats
+from services.plan_batcher import PlanBatcherStats
+from services.prompt_context import PromptContextStats
+from utils.cache import CacheStats
+from utils.deadline import Deadline
+from utils.prompts import PROMPT_VERSION
+from utils.singleflight import SingleFlightStats
+from web.sse import sse_event, sse_response
+from utils.timing import TimingStats
 
 router = APIRouter(prefix="/query", tags=["Query"])
 
 
+class QueryStats(BaseModel):
+    prompt_version: str
+    # What answered the LLM calls: gemini, synthetic, cassette-record/replay
+    llm_backend: str
+    plan_cache: CacheStats
+    plan_store: CacheStats
+    intent_parser: IntentParserStats
+    prompt_context: PromptContextStats
+    llm: LlmCallStats
+    llm_tokens: LlmUsageStats
+    llm_coalescing: SingleFlightStats
+    # None unless LLM_BATCH_ENABLED
+    llm_batching: Optional[PlanBatcherStats]
+    action_timings: Dict[str, TimingStats]
+
+
 class UserQueryInput(BaseModel):
     """
     Model for user query input.
@@ -21,31 +54,76 @@ class UserQueryInput(BaseModel):
     query: str
 
 
+class UserActionsInput(BaseModel):
+    """
+    Model for executing actions: either a ``plan_id`` returned by ``/query``
+    or a ``query`` to plan from scratch.
+    """
+
+    customer_id: int
+    query: Optional[str] = None
+    plan_id: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_query_or_plan(self) -> "UserActionsInput":
+        if self.query is None and self.plan_id is None:
+            raise ValueError("Either query or plan_id is required")
+        return self
+
+
+class PlannedActionsResponse(AppResponse[UserActions]):
+    # Pass to /query/actions to execute this exact plan.
+    plan_id: Optional[str] = None
+
+
+def _load_customer(customer_id: int) -> AppResponse[CustomerDb]:
+    # A short-lived session, closed before planning: the LLM call must not
+    # keep a pooled connection checked out.
+    with new_session() as session:
+        return customer_service.get_customer_by_id(session, customer_id)
+
+
+def _plan_error_status(response: AppResponse) -> int:
+    cause = response.error.cause if response.error else None
+    if cause == "timeout":
+        return status.HTTP_504_GATEWAY_TIMEOUT
+    if cause == "unavailable":
+        return status.HTTP_503_SERVICE_UNAVAILABLE
+    return status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
 @router.post(
     "",
+    response_model=PlannedActionsResponse,
     responses={
         status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": AppResponse[UserActions]}
     },
 )
-def user_query_handler(input: UserQueryInput):
+async def user_query_handler(input: UserQueryInput):
     """
     Endpoint to handle user queries.
     """
-    customer_response = customer_service.get_customer_by_id(input.customer_id)
+    deadline = Deadline.after(CONFIG.query_timeout_seconds)
+    customer_response = await run_in_threadpool(_load_customer, input.customer_id)
     if not customer_response.data:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content=jsonable_encoder(customer_response),
         )
-    action_plan_response = user_query_service.get_action_plan(
-        customer=customer_response.data, task_description=input.query
+    action_plan_response = await user_query_service.get_action_plan(
+        customer=customer_response.data,
+        task_description=input.query,
+        deadline=deadline,
     )
     if not action_plan_response.data:
         return JSONResponse(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            status_code=_plan_error_status(action_plan_response),
             content=jsonable_encoder(action_plan_response),
         )
-    return action_plan_response
+    plan_id = user_query_service.store_plan(
+        input.customer_id, action_plan_response.data
+    )
+    return PlannedActionsResponse(data=action_plan_response.data, plan_id=plan_id)
 
 
 @router.post(
@@ -54,26 +132,223 @@ def user_query_handler(input: UserQueryInput):
         status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": AppResponse[UserActions]}
     },
 )
-def user_actions_handler(input: UserQueryInput):
+async def user_actions_handler(input: UserActionsInput, session: SessionDep):
     """
     Endpoint to handle user actions.
     """
-    customer_response = customer_service.get_customer_by_id(input.customer_id)
+    deadline = Deadline.after(CONFIG.query_timeout_seconds)
+    if input.plan_id is not None:
+        # The plan was made for this customer by /query; no second LLM call.
+        user_actions = user_query_service.take_plan(input.customer_id, input.plan_id)
+        if user_actions is None:
+            return JSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content=jsonable_encoder(
+                    AppResponse(
+                        error=ErrorDetail(
+                            message="Plan not found or expired", cause="not-found"
+                        )
+                    )
+                ),
+            )
+    else:
+        customer_response = await run_in_threadpool(_load_customer, input.customer_id)
+        if not customer_response.data:
+            return JSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content=jsonable_encoder(customer_response),
+            )
+        action_plan_response = await user_query_service.get_action_plan(
+            customer=customer_response.data,
+            task_description=input.query or "",
+            deadline=deadline,
+        )
+        if not action_plan_response.data:
+            return JSONResponse(
+                status_code=_plan_error_status(action_plan_response),
+                content=jsonable_encoder(action_plan_response),
+            )
+        user_actions = action_plan_response.data
+    # Execute the actions; this is plain DB work, keep it off the event loop.
+    # The request session is first used here, after planning.
+    action_plan_executed_response = await run_in_threadpool(
+        user_query_service.execute_actions,
+        session,
+        customer_id=input.customer_id,
+        user_actions=user_actions,
+    )
+    return action_plan_executed_response
+
+
+def _execute_streamed_action(
+    customer_id: int, action: Action
+) -> AppResponse[List[ActionResponse]]:
+    # Dependency sessions are closed before a streamed body is sent, and the
+    # LLM stream must not keep a connection checked out between actions: own
+    # a session for just this action.
+    with new_session() as session:
+        return user_query_service.execute_actions(
+            session, customer_id=customer_id, user_actions=UserActions(actions=[action])
+        )
+
+
+async def _plan_events(
+    customer: CustomerBase,
+    query: str,
+    deadline: Deadline,
+    execute: bool,
+) -> AsyncIterator[str]:
+    """
+    ``action`` events as the plan streams in and, when ``execute`` is set, a
+    ``result`` event for each action right after it ran. Ends with ``done``
+    or ``error``.
+    """
+    actions: List[Action] = []
+    async for response in user_query_service.stream_action_plan(
+        customer=customer, task_description=query, deadline=deadline
+    ):
+        if response.data is None:
+            yield sse_event("error", response)
+            return
+        actions.append(response.data)
+        yield sse_event("action", response)
+        if execute:
+            # Each streamed action commits on its own: the rest of the plan is
+            # not known yet.
+            result = await run_in_threadpool(
+                _execute_streamed_action, customer.id, response.data
+            )
+            yield sse_event("result", _single_result(result))
+    if execute:
+        yield sse_event("done", {})
+    else:
+        plan_id = user_query_service.store_plan(
+            customer.id, UserActions(actions=actions)
+        )
+        yield sse_event("done", {"plan_id": plan_id})
+
+
+async def _stored_plan_events(
+    customer_id: int, user_actions: UserActions
+) -> AsyncIterator[str]:
+    """
+    The stored plan is known in full, so it runs as one unit of work like
+    ``/query/actions``: a ``result`` event per action as its savepoint is
+    settled, then ``done`` once the plan has committed. The plan keeps
+    running to its commit if the client goes away.
+    """
+    loop = asyncio.get_running_loop()
+    results: "asyncio.Queue[ActionResponse]" = asyncio.Queue()
+
+    def execute() -> AppResponse[List[ActionResponse]]:
+        # Dependency sessions are closed before a streamed body is sent.
+        with new_session() as session:
+            return user_query_service.execute_actions(
+                session,
+                customer_id=customer_id,
+                user_actions=user_actions,
+                on_result=lambda result: loop.call_soon_threadsafe(
+                    results.put_nowait, result
+                ),
+            )
+
+    execution = asyncio.ensure_future(run_in_threadpool(execute))
+    while True:
+        next_result = asyncio.ensure_future(results.get())
+        try:
+            await asyncio.wait(
+                (next_result, execution), return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            got_result = next_result.done()
+            if not got_result:
+                next_result.cancel()
+        if not got_result:
+            break
+        yield sse_event("result", next_result.result())
+    # Results handed over just before the plan finished.
+    while not results.empty():
+        yield sse_event("result", results.get_nowait())
+    executed = execution.result()
+    if executed.error:
+        yield sse_event("error", executed)
+        return
+    yield sse_event("done", {})
+
+
+def _single_result(result: AppResponse[List[ActionResponse]]) -> AppResponse:
+    return result.data[0] if result.data else result
+
+
+@router.post("/stream")
+async def user_query_stream_handler(input: UserQueryInput):
+    """
+    Streaming variant of ``POST /query``: server-sent ``action`` events as
+    soon as each action is parsed, then ``done`` with the ``plan_id``.
+    """
+    deadline = Deadline.after(CONFIG.query_timeout_seconds)
+    customer_response = await run_in_threadpool(_load_customer, input.customer_id)
     if not customer_response.data:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content=jsonable_encoder(customer_response),
         )
-    action_plan_response = user_query_service.get_action_plan(
-        customer=customer_response.data, task_description=input.query
+    return sse_response(
+        _plan_events(customer_response.data, input.query, deadline, execute=False)
     )
-    if not action_plan_response.data:
+
+
+@router.post("/actions/stream")
+async def user_actions_stream_handler(input: UserActionsInput):
+    """
+    Streaming variant of ``POST /query/actions``: each action runs as soon
+    as it is parsed, with its ``action`` and ``result`` events, then ``done``.
+    """
+    deadline = Deadline.after(CONFIG.query_timeout_seconds)
+    if input.plan_id is not None:
+        user_actions = user_query_service.take_plan(input.customer_id, input.plan_id)
+        if user_actions is None:
+            return JSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content=jsonable_encoder(
+                    AppResponse(
+                        error=ErrorDetail(
+                            message="Plan not found or expired", cause="not-found"
+                        )
+                    )
+                ),
+            )
+        return sse_response(_stored_plan_events(input.customer_id, user_actions))
+    customer_response = await run_in_threadpool(_load_customer, input.customer_id)
+    if not customer_response.data:
         return JSONResponse(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            content=jsonable_encoder(action_plan_response),
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=jsonable_encoder(customer_response),
         )
-    # Execute the actions
-    action_plan_executed_response = user_query_service.execute_actions(
-        customer_id=input.customer_id, user_actions=action_plan_response.data
+    return sse_response(
+        _plan_events(customer_response.data, input.query or "", deadline, execute=True)
+    )
+
+
+@router.get("/stats")
+def query_stats() -> QueryStats:
+    """
+    Endpoint to inspect the query pipeline caches.
+    """
+    return QueryStats(
+        prompt_version=PROMPT_VERSION,
+        llm_backend=user_query_service.llm_backend.name,
+        plan_cache=user_query_service.plan_cache.stats(),
+        plan_store=user_query_service.plan_store.stats(),
+        intent_parser=user_query_service.intent_parser.stats(),
+        prompt_context=user_query_service.prompt_context.stats(),
+        llm=user_query_service.llm.stats(),
+        llm_tokens=user_query_service.llm_backend.usage(),
+        llm_coalescing=user_query_service.llm_flights.stats(),
+        llm_batching=(
+            user_query_service.plan_batcher.stats()
+            if user_query_service.plan_batcher is not None
+            else None
+        ),
+        action_timings=user_query_service.action_timings.stats(),
     )
-    return action_plan_executed_response
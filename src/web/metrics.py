@@ -0,0 +1,62 @@
+import time
+from typing import Any, Callable, Dict
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.metrics import metrics
+
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds",
+    "Time to the last byte of the response, per route template",
+    ("method", "route", "status"),
+)
+
+
+class MetricsMiddleware:
+    """
+    Times every HTTP request until its response is fully sent. Requests are
+    labelled with the route's path template, not the raw path, so ids in
+    URLs don't multiply the series; unmatched paths share one label.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._routes: Dict[Callable[..., Any], str] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_request_duration.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                self._route(scope),
+                str(status),
+            )
+
+    def _route(self, scope: Scope) -> str:
+        # The router leaves the matched endpoint in the scope.
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            for candidate in scope["app"].routes:
+                if getattr(candidate, "endpoint", None) is endpoint:
+                    route = self._routes[endpoint] = candidate.path
+                    break
+            else:
+                return "unmatched"
+        return route
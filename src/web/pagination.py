@@ -0,0 +1,61 @@
+from datetime import datetime
+from typing import Annotated, Iterable, Optional, Sequence
+
+from fastapi import Depends, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-After-Id"
+# Lists in (timestamp, id) order page on both; see set_next_cursor.
+NEXT_TIMESTAMP_HEADER = "X-Next-After-Timestamp"
+
+
+class PageParams(BaseModel):
+    """
+    Keyset page: rows with an id greater than ``after_id``, in id order.
+    Without a ``limit`` the whole list is returned.
+    """
+
+    limit: Optional[int] = None
+    after_id: Optional[int] = None
+
+
+def _page_params(
+    limit: Annotated[Optional[int], Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    after_id: Annotated[Optional[int], Query(ge=0)] = None,
+) -> PageParams:
+    return PageParams(limit=limit, after_id=after_id)
+
+
+PageDep = Annotated[PageParams, Depends(_page_params)]
+
+
+def set_next_cursor(
+    response: Response,
+    page: PageParams,
+    rows: Optional[Sequence[BaseModel]],
+    with_timestamp: bool = False,
+) -> None:
+    """
+    Advertise the ``after_id`` of the next page when this one came back full;
+    ``with_timestamp`` adds its ``after_timestamp`` for lists in (timestamp,
+    id) order.
+    """
+    if page.limit is None or not rows or len(rows) < page.limit:
+        return
+    last_id = getattr(rows[-1], "id", None)
+    if last_id is None:
+        return
+    response.headers[NEXT_CURSOR_HEADER] = str(last_id)
+    if with_timestamp:
+        last_timestamp: datetime = getattr(rows[-1], "timestamp")
+        response.headers[NEXT_TIMESTAMP_HEADER] = last_timestamp.isoformat()
+
+
+def ndjson_response(rows: Iterable[BaseModel]) -> StreamingResponse:
+    """Stream one JSON document per line as the rows are produced."""
+    return StreamingResponse(
+        (row.model_dump_json() + "\n" for row in rows),
+        media_type="application/x-ndjson",
+    )
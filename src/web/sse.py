@@ -0,0 +1,19 @@
+import json
+from typing import Any, AsyncIterable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+
+def sse_event(event: str, data: Any) -> str:
+    """One server-sent event; ``data`` is JSON-encoded on a single line."""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+def sse_response(events: AsyncIterable[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # Proxies must pass events through as they come.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
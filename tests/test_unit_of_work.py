@@ -0,0 +1,111 @@
+"""
+Run from src/:  python -m unittest discover -s ../tests
+"""
+
+import os
+import tempfile
+import unittest
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp.name}/test.db"
+os.environ.setdefault("LLM_BACKEND", "synthetic")
+
+from sqlmodel import select  # noqa: E402
+
+from domain.models.action import PurchaseAction, UserActions  # noqa: E402
+from domain.models.app import AppResponse  # noqa: E402
+from domain.models.customer import CustomerDb  # noqa: E402
+from domain.models.soda import Soda  # noqa: E402
+from domain.models.transaction_customer import TransactionCustomer  # noqa: E402
+from infra.db.sqlite import (  # noqa: E402
+    create_db_and_tables,
+    new_session,
+    unit_of_work,
+)
+from services.user_query import user_query_service  # noqa: E402
+
+
+def tearDownModule() -> None:
+    _tmp.cleanup()
+
+
+class UnitOfWorkTest(unittest.TestCase):
+    def setUp(self) -> None:
+        create_db_and_tables()
+        with new_session() as session:
+            for model in (TransactionCustomer, Soda, CustomerDb):
+                for row in session.exec(select(model)).all():
+                    session.delete(row)
+            session.commit()
+            soda = Soda(name="Cola", price=1.5, quantity=8)
+            customer = CustomerDb(name="Ann", email="ann@example.com", password="x")
+            session.add_all([soda, customer])
+            session.commit()
+            self.soda_id, self.customer_id = soda.id, customer.id
+
+    def _stock(self) -> int:
+        with new_session() as session:
+            soda = session.get(Soda, self.soda_id)
+            assert soda is not None
+            return soda.quantity
+
+    def _purchases(self) -> int:
+        with new_session() as session:
+            return len(session.exec(select(TransactionCustomer)).all())
+
+    def _purchase(self, quantity: int):
+        return lambda session: user_query_service.handle_purchase_action(
+            session,
+            customer_id=self.customer_id,
+            action=PurchaseAction(soda_name="Cola", quantity=quantity),
+        )
+
+    def test_failed_action_rolls_back_only_itself(self) -> None:
+        plan = UserActions(
+            actions=[
+                PurchaseAction(soda_name="Cola", quantity=2),
+                PurchaseAction(soda_name="Cola", quantity=100),
+            ]
+        )
+        with new_session() as session:
+            response = user_query_service.execute_actions(
+                session, self.customer_id, plan
+            )
+        assert response.data is not None
+        self.assertIsNone(response.data[0].error)
+        self.assertIsNotNone(response.data[1].error)
+        self.assertEqual(self._stock(), 6)
+        self.assertEqual(self._purchases(), 1)
+
+    def test_plan_commits_once_at_the_end(self) -> None:
+        seen_by_others = []
+
+        def look(_session):
+            seen_by_others.append((self._stock(), self._purchases()))
+            return AppResponse(data=None)
+
+        with new_session() as session:
+            with unit_of_work(session) as work:
+                work.run(self._purchase(2))
+                work.run(look)
+                work.run(self._purchase(1))
+                work.run(look)
+        self.assertEqual(seen_by_others, [(8, 0), (8, 0)])
+        self.assertEqual(self._stock(), 5)
+        self.assertEqual(self._purchases(), 2)
+
+    def test_raising_action_rolls_back_the_plan(self) -> None:
+        def fail(_session):
+            raise RuntimeError("boom")
+
+        with new_session() as session:
+            with self.assertRaises(RuntimeError):
+                with unit_of_work(session) as work:
+                    work.run(self._purchase(2))
+                    work.run(fail)
+        self.assertEqual(self._stock(), 8)
+        self.assertEqual(self._purchases(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()